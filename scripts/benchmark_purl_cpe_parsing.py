@@ -0,0 +1,74 @@
+import sys
+import time
+import pandas as pd
+
+from os import cpu_count
+from pathlib import Path
+from itertools import islice
+
+from cpeparser import CpeParser
+from packageurl import PackageURL
+
+from get_products_language import iter_purl2cpe_pairs, get_vendor_product_purl_df
+
+
+def get_vendor_product_purl_df_reference(purl_cpe_pairs: list, cpe_parser: CpeParser) -> pd.DataFrame:
+    """
+    Parse the pairs with CpeParser and PackageURL only, as get_vendor_product_purl_df did before the fast path.
+    """
+    rows = []
+
+    for purl, cpe in purl_cpe_pairs:
+        try:
+            cpe_obj = cpe_parser.parser(cpe)
+        except Exception:
+            continue
+
+        try:
+            purl_obj = PackageURL.from_string(purl)
+        except ValueError:
+            continue
+
+        row = purl_obj.to_dict()
+        row.update({"vendor": cpe_obj['vendor'], "product": cpe_obj['product']})
+        rows.append(row)
+
+    mappings_df = pd.DataFrame(rows)
+    mappings_df.drop_duplicates(subset=["vendor", "product"], inplace=True)
+
+    return mappings_df
+
+
+def benchmark(db_file: Path, limit: int = None):
+    """
+    Check that the fast path gives the same vendor-product-purl mappings as the full parsers on the pairs of the
+    purl2cpe database, and compare their run times.
+
+    Args:
+        db_file: Path to the purl2cpe database
+        limit: Number of pairs to use (default: all)
+    """
+    pairs = list(islice(iter_purl2cpe_pairs(db_file), limit))
+    cpe_parser = CpeParser()
+    workers = cpu_count() or 1
+    print(f"Benchmarking on {len(pairs)} purl-cpe pairs")
+
+    start = time.perf_counter()
+    reference_df = get_vendor_product_purl_df_reference(pairs, cpe_parser)
+    reference_time = time.perf_counter() - start
+    print(f"CpeParser and PackageURL: {reference_time:.2f}s")
+
+    for label, n_workers in [("Fast path", 1), (f"Fast path, {workers} workers", workers)]:
+        start = time.perf_counter()
+        fast_df = get_vendor_product_purl_df(pairs, cpe_parser, workers=n_workers)
+        fast_time = time.perf_counter() - start
+
+        pd.testing.assert_frame_equal(reference_df, fast_df)
+        print(f"{label}: {fast_time:.2f}s ({reference_time / fast_time:.1f}x), same mappings")
+
+
+if __name__ == "__main__":
+    benchmark(
+        db_file=Path(sys.argv[1] if len(sys.argv) > 1 else "~/projects/purl2cpe.db").expanduser(),
+        limit=int(sys.argv[2]) if len(sys.argv) > 2 else None
+    )
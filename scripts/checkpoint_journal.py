@@ -0,0 +1,101 @@
+import os
+import json
+import time
+
+from pathlib import Path
+from typing import List, Tuple, Iterable
+
+
+class CheckpointJournal:
+    """
+    Append-only journal of (vendor, product, language) updates, stored as JSON lines.
+
+    Updates are buffered and flushed to disk every flush_every updates or flush_interval seconds, whichever comes
+    first, so a run that is killed loses at most the updates since the last flush. A line cut short by a crash is
+    dropped on replay, so that the next updates start on a line of their own.
+    """
+
+    def __init__(self, journal_path: Path, flush_every: int = 500, flush_interval: float = 30.0):
+        """
+        Args:
+            journal_path: Path to the journal file
+            flush_every: Maximum number of buffered updates
+            flush_interval: Maximum number of seconds between flushes of buffered updates
+        """
+        self.journal_path = journal_path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._file = None
+
+    def __enter__(self) -> 'CheckpointJournal':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def replay(self) -> List[Tuple[str, str, str]]:
+        """
+        Read the updates recorded by previous runs, in the order they were written. A final line without a newline
+        was cut short by a crash; it is truncated from the file, as the next flush would append to it otherwise.
+        """
+        if not self.journal_path.exists():
+            return []
+
+        updates = []
+        # offset of the end of the last complete line
+        end = 0
+
+        with self.journal_path.open('rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+
+                end += len(line)
+
+                try:
+                    vendor, product, language = json.loads(line)
+                except ValueError:
+                    continue
+
+                updates.append((vendor, product, language))
+
+        if end < self.journal_path.stat().st_size:
+            with self.journal_path.open('r+b') as f:
+                f.truncate(end)
+
+        return updates
+
+    def append(self, updates: Iterable[Tuple[str, str, str]]):
+        self._buffer.extend(updates)
+
+        if len(self._buffer) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            if self._file is None:
+                self._file = self.journal_path.open('a')
+
+            self._file.writelines(f"{json.dumps(update)}\n" for update in self._buffer)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._buffer = []
+
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """
+        Discard the journal, once its updates are saved elsewhere.
+        """
+        self._buffer = []
+        self.close()
+        self.journal_path.unlink(missing_ok=True)
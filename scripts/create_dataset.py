@@ -3,15 +3,18 @@ import json
 import pandas as pd
 
 from tqdm import tqdm
+from os import cpu_count
+from collections import Counter
 from typing import List
 from pathlib import Path
-from typing import Optional
-from urllib.parse import urlparse
+from typing import Optional, Set, Iterator, Tuple, Dict, Iterable, Union
+from concurrent.futures import ProcessPoolExecutor
 
 from cpelib.types.definitions import CPEPart
 
 from nvdutils.models.configurations import Configurations
-from nvdutils.loaders.json.default import JSONDefaultLoader
+
+from cve_file_index import CVEFileIndex
 
 
 root_path = Path(__file__).parent.parent
@@ -33,82 +36,167 @@ SOFTWARE_TYPE_SCORE = {
 
 # Mapping of file extensions to programming languages
 LANGUAGE_EXTENSION_MAPPING = json.load(open(language_extension_mapping_file_path))
-LANGUAGE_FILE_EXTENSIONS = list(set([_ext[1:].lower() for _langs in LANGUAGE_EXTENSION_MAPPING.values() for _exts in _langs.values() for _ext in _exts]))
 
-# Match file-like strings, with at least one letter before the dot
-# and a known file extension (to reduce false positives)
-# Join extensions into a regex group
-EXT_GROUP = '|'.join(LANGUAGE_FILE_EXTENSIONS)
 
-# Regex: match strings like `index.php`, not `1.2.3`
-FILE_NAME_PATTERN = rf'\b[a-zA-Z0-9_\-/]+\.({EXT_GROUP})\b'
-# A rough pattern to detect if a match is part of a URL
-URL_PATTERN = re.compile(r'https?://[^\s]+')
+def build_extension_language_index(language_extension_mapping: dict) -> Dict[str, Tuple[str, str]]:
+    """
+    Build a lookup table from file extension to (category, language).
+
+    Extensions listed for more than one language (e.g., .m, .hh, .sql) map to the first one in category order
+    (primary before secondary), then in the order of the mapping file.
+
+    Args:
+        language_extension_mapping: Categories of languages and their file extensions
+
+    Returns:
+        Dictionary mapping lower-case extensions, without the dot, to (category, language) tuples
+    """
+    index = {}
+
+    for category, languages in language_extension_mapping.items():
+        for language, extensions in languages.items():
+            for extension in extensions:
+                index.setdefault(extension[1:].lower(), (category, language))
+
+    return index
 
 
-def get_product_details_df(product_lang_df_path: Path, product_sw_type_df_path: Path) -> dict:
+EXTENSION_LANGUAGE_INDEX = build_extension_language_index(LANGUAGE_EXTENSION_MAPPING)
+# lower values take precedence when languages are tied
+LANGUAGE_PRIORITY = {
+    _lang: _priority for _priority, _langs in enumerate(LANGUAGE_EXTENSION_MAPPING.values()) for _lang in _langs
+}
+LANGUAGE_FILE_EXTENSIONS = frozenset(EXTENSION_LANGUAGE_INDEX)
+
+# File-like strings have at least one letter before the dot and a known file extension (to reduce false positives),
+# e.g., `index.php`, not `1.2.3`. Candidates are found from their dot: the word after it is looked up in
+# LANGUAGE_FILE_EXTENSIONS, and only then the start of the name is searched (up to the dot, given as endpos)
+DOT_PATTERN = re.compile(r'\.(?=([a-zA-Z0-9_]+))')
+FILE_NAME_START_PATTERN = re.compile(r'\b[a-zA-Z0-9_\-/]+\Z')
+WORD_CHAR_PATTERN = re.compile(r'\w')
+# Match URLs and capture their hostname (after the optional user info, before the port or path)
+URL_PATTERN = re.compile(r'https?://(?=\S)(?:[^\s/?#]*@)?(?P<hostname>\[[^\s/?#\]]*\]|[^\s/?#:@]*)\S*')
+
+
+def get_product_details_df(product_lang_df_path: Path, product_sw_type_df_path: Path) -> Dict[Tuple[str, str], tuple]:
+    """
+    Load the product details, keyed by (vendor, product), with the product score precomputed.
+
+    Args:
+        product_lang_df_path: Path to the products language CSV file
+        product_sw_type_df_path: Path to the software type CSV file
+
+    Returns:
+        Dictionary mapping (vendor, product) tuples to (score, details) tuples
+    """
     product_lang_df = pd.read_csv(product_lang_df_path)
     product_sw_type_df = pd.read_csv(product_sw_type_df_path)
-    product_details = {}
 
     merged_df = pd.merge(product_lang_df, product_sw_type_df, on=["vendor", "product"], how="outer")
     merged_df.rename(columns={"type": "package_type"}, inplace=True)
-    merged_df = merged_df.applymap(lambda x: None if pd.isna(x) else x)
+    merged_df = merged_df[['vendor', 'product', 'package_type', 'software_type', 'language']]
+    merged_df = merged_df.astype(object).where(merged_df.notna(), None)
 
     # merged_df.dropna(subset=["language", "software_type"], inplace=True)
     print(f"Found {len(merged_df)} products with language and software type")
+    print(f"Product details use {merged_df.memory_usage(deep=True).sum() / 2 ** 20:.1f} MiB")
 
-    for _, row in tqdm(merged_df.iterrows(), total=len(merged_df), desc="Loading products details."):
-        row_dict = row[['vendor', 'product', 'package_type', 'software_type', 'language']].to_dict()
-        product_details[f"{row['vendor']}_{row['product']}"] = row_dict
+    # score by software type, plus one for GitHub packages
+    product_scores = merged_df['software_type'].map(SOFTWARE_TYPE_SCORE).fillna(0).astype(int)
+    product_scores += (merged_df['package_type'] == 'github').astype(int)
 
-    return product_details
+    # build the records from the columns, to_dict('records') is several times slower
+    columns = merged_df.columns.tolist()
+    records = [dict(zip(columns, row)) for row in zip(*(merged_df[column].tolist() for column in columns))]
+    keys = zip(merged_df['vendor'], merged_df['product'])
+    values = zip(product_scores.tolist(), records)
 
+    return dict(zip(keys, values))
 
-def select_vulnerable_product(configurations: Configurations, products_details: dict) -> Optional[dict]:
-    best_product = (None, -1)
+
+def select_vulnerable_product(configurations: Configurations,
+                              products_details: Dict[Tuple[str, str], tuple]) -> Optional[dict]:
+    best_product = None
+    best_score = -1
 
     for vuln_prod in configurations.vulnerable_products:
         if vuln_prod.part != CPEPart.Application:
             continue
 
-        product_id = f"{vuln_prod.vendor}_{vuln_prod.name}"
-
-        if product_id not in products_details:
-            continue
+        product = products_details.get((vuln_prod.vendor, vuln_prod.name))
 
-        product_dict = products_details[product_id]
-        product_score = 0
+        if product is not None and product[0] > best_score:
+            best_score, best_product = product
 
-        if product_dict['software_type']:
-            product_score = SOFTWARE_TYPE_SCORE[product_dict['software_type']]
+    return best_product
 
-        product_score += 1 if product_dict['package_type'] == 'github' else 0
 
-        if product_score > best_product[1]:
-            best_product = (product_dict, product_score)
+def overlaps_any(text: str, start: int, end: int, substrings: Set[str]) -> bool:
+    """
+    Check if any occurrence of the substrings overlaps text[start:end], without slicing the text.
+    """
+    for substring in substrings:
+        if text.find(substring, max(start - len(substring) + 1, 0), end + len(substring) - 1) != -1:
+            return True
 
-    return best_product[0]
+    return False
 
 
 def extract_file_names(description: str) -> List[str]:
     """
     Extract potential file names from a description text.
 
+    The description is scanned once for URLs and once for dots, without copies of the text: the hostnames of URLs are
+    skipped by offset, so the top-level domain is not picked as an extension, and file names overlapping other
+    mentions of those hostnames are discarded.
+
     Args:
         description: The CVE description text
 
     Returns:
         A list of potential file names found in the description
     """
-    # Find all matches
-    urls = re.findall(URL_PATTERN, description)
+    # (start, end) offsets of the hostnames in URLs
+    host_spans = [match.span('hostname') for match in URL_PATTERN.finditer(description) if match.group('hostname')]
+    hostnames = {description[start:end] for start, end in host_spans}
+    file_names = []
+    # end of the last file name found
+    last_end = 0
+    host_index = 0
+    host_end = -1
+
+    for dot in DOT_PATTERN.finditer(description):
+        if dot.group(1) not in LANGUAGE_FILE_EXTENSIONS:
+            continue
+
+        dot_pos, extension_end = dot.span(1)
+        dot_pos -= 1
+
+        # move to the last hostname starting before the dot
+        while host_index < len(host_spans) and host_spans[host_index][0] < dot_pos:
+            host_end = host_spans[host_index][1]
+            host_index += 1
+
+        if dot_pos < host_end or dot_pos < last_end or WORD_CHAR_PATTERN.match(description, extension_end):
+            # within a hostname or the last file name, or the extension does not end at a word boundary
+            continue
+
+        start = FILE_NAME_START_PATTERN.search(description, max(last_end, host_end, 0), dot_pos)
+
+        if start and start.start() == host_end and not WORD_CHAR_PATTERN.match(description, host_end):
+            # behave as if the hostname was removed: its last character does not form a word boundary
+            start = FILE_NAME_START_PATTERN.search(description, host_end + 1, dot_pos)
+
+        if not start:
+            continue
 
-    for url in urls:
-        # remove the hostname so it does not pick the top-level domain
-        description = description.replace(urlparse(url).hostname, '')
+        start = start.start()
 
-    file_names = re.findall(FILE_NAME_PATTERN, description)
+        if hostnames and overlaps_any(description, start, extension_end, hostnames):
+            continue
+
+        file_names.append(description[start:extension_end])
+        last_end = extension_end
 
     return file_names
 
@@ -127,82 +215,164 @@ def determine_language_from_file_names(file_paths: List[str]) -> Optional[str]:
         return None
 
     # Count occurrences of each language
-    language_counts = {}
+    language_counts = Counter()
 
     for path in file_paths:
-        # Extract extension
-        extension = path.split('.')[-1].lower()
+        match = EXTENSION_LANGUAGE_INDEX.get(path.rsplit('.', 1)[-1].lower())
 
-        # Check if extension is in our mapping
-        for category, languages in LANGUAGE_EXTENSION_MAPPING.items():
-            for language, extensions in languages.items():
-                if f".{extension}" in extensions:
-                    language_counts[language] = language_counts.get(language, 0) + 1
-                    break
+        if match:
+            language_counts[match[1]] += 1
 
-    # Return the most common language if any were found
+    # Return the most common language if any were found; ties go to the language of the higher priority category,
+    # then to the one found first
     if language_counts:
-        return max(language_counts.items(), key=lambda x: x[1])[0]
+        return max(language_counts, key=lambda x: (language_counts[x], -LANGUAGE_PRIORITY[x]))
 
     return None
 
 
-def create_dataset_df(nvd_data_path: Path, cve_cwe_df: pd.DataFrame, product_details: dict) -> pd.DataFrame:
-    rows = []
-    loader = JSONDefaultLoader()
-    index = {file.stem: file for file in nvd_data_path.expanduser().rglob(r"CVE*.json")}
-    print(f"Found {len(index)} CVE files")
-    language_from_description_count = 0
+def infer_language_from_description(description: Optional[str]) -> Tuple[Optional[str], List[str]]:
+    """
+    Infer the programming language of a CVE from the file names in its description.
+
+    Args:
+        description: The CVE description text
+
+    Returns:
+        Tuple of (language or None, file names with an extension of that language)
+    """
+    if not isinstance(description, str):
+        return None, []
+
+    file_names = extract_file_names(description)
+    language = determine_language_from_file_names(file_names)
+
+    if not language:
+        return None, []
+
+    evidence = [name for name in file_names if EXTENSION_LANGUAGE_INDEX[name.rsplit('.', 1)[-1]][1] == language]
+
+    return language, evidence
+
+
+def infer_languages_chunk(descriptions: List[Optional[str]]) -> List[Tuple[Optional[str], List[str]]]:
+    return [infer_language_from_description(description) for description in descriptions]
+
+
+def infer_languages_from_descriptions(descriptions: Union[pd.Series, Iterable[str]], workers: int = 1,
+                                      chunk_size: int = 10000) -> pd.DataFrame:
+    """
+    Infer the programming language of many descriptions at once, optionally in chunks across a process pool.
+
+    Args:
+        descriptions: Series or iterable of CVE description texts
+        workers: Number of worker processes; 1 runs in the current process
+        chunk_size: Number of descriptions per chunk sent to a worker
+
+    Returns:
+        DataFrame with 'language' and 'language_evidence' (list of file names) columns, aligned with the descriptions
+        (same index if a Series is given)
+    """
+    if not isinstance(descriptions, pd.Series):
+        descriptions = pd.Series(list(descriptions), dtype=object)
+
+    values = descriptions.tolist()
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = [result for chunk in executor.map(infer_languages_chunk, chunks) for result in chunk]
+    else:
+        results = [result for chunk in chunks for result in infer_languages_chunk(chunk)]
 
-    for i, row in tqdm(cve_cwe_df.iterrows()):
-        cve = loader.load_by_id(cve_id=row.cve_id, index=index)
+    return pd.DataFrame(results, index=descriptions.index, columns=['language', 'language_evidence'])
 
+
+def iter_cve_details(nvd_data_path: Path, cve_ids: Set[str]) -> Iterator[Tuple[str, Configurations, str]]:
+    """
+    Iterate the NVD feed once, in directory order, and extract the details of the selected CVEs.
+
+    The files are looked up in the persisted CVE file index, so files of other CVEs are neither listed nor opened, and
+    only the configurations and the English description are parsed, instead of the full CVE model.
+
+    Args:
+        nvd_data_path: Path to the NVD JSON data feeds
+        cve_ids: IDs of the CVEs to extract
+
+    Returns:
+        Iterator of (cve_id, configurations, english description) tuples
+    """
+    cve_file_index = CVEFileIndex(nvd_data_path)
+    cve_file_index.update()
+    cve_file_paths = cve_file_index.get_paths(cve_ids)
+    cve_file_index.close()
+    print(f"Found {len(cve_file_paths)} CVE files")
+
+    for cve_id, file_path in sorted(cve_file_paths.items(), key=lambda x: x[1]):
+        with file_path.open('r') as f:
+            cve_data = json.load(f)
+
+        configurations = Configurations(elements=cve_data.get('configurations', []))
+        description = next(desc['value'] for desc in cve_data['descriptions'] if desc['lang'] == 'en')
+
+        yield cve_id, configurations, description
+
+
+def create_dataset_df(nvd_data_path: Path, cve_cwe_df: pd.DataFrame, product_details: Dict[Tuple[str, str], tuple],
+                      workers: int = 1) -> pd.DataFrame:
+    dataset_rows = {}
+    cve_cwe_rows = {row['cve_id']: row for row in cve_cwe_df.to_dict('records')}
+
+    cve_details = iter_cve_details(nvd_data_path, set(cve_cwe_rows))
+
+    for cve_id, configurations, description in tqdm(cve_details, total=len(cve_cwe_rows)):
         vulnerable_product = select_vulnerable_product(
-            configurations=cve.configurations, products_details=product_details
+            configurations=configurations, products_details=product_details
         )
 
         if not vulnerable_product:
             continue
 
-        row_dict = row.to_dict()
+        row_dict = dict(cve_cwe_rows[cve_id])
         row_dict.update(vulnerable_product)
+        row_dict['description'] = description
+        dataset_rows[cve_id] = row_dict
 
-        # Try to extract language from description if available
-        file_names = extract_file_names(cve.descriptions.get_eng_description().value)
-        language_from_description = determine_language_from_file_names(file_names)
-
-        # Update language if found in description
-        if language_from_description:
-            row_dict['language'] = language_from_description
-            row_dict['language_source'] = 'description'
-            language_from_description_count += 1
-        else:
-            row_dict['language_source'] = 'product_details'
+    # keep the order of the CVE-CWE rows, regardless of the order of the feed
+    _df = pd.DataFrame([dataset_rows[cve_id] for cve_id in cve_cwe_rows if cve_id in dataset_rows])
+    print(f"Found {len(_df)} CVEs with product details.")
 
-        rows.append(row_dict)
+    if _df.empty:
+        return _df
 
-    _df = pd.DataFrame(rows)
-    print(f"Found {len(_df)} CVEs with product details.")
-    print(f"Found {language_from_description_count} CVEs with language determined from description")
+    # Try to extract language from description, otherwise keep the language from the product details
+    languages_df = infer_languages_from_descriptions(_df.pop('description'), workers=workers)
+    from_description = languages_df['language'].notna()
+    _df.loc[from_description, 'language'] = languages_df.loc[from_description, 'language']
+    _df['language_source'] = from_description.map({True: 'description', False: 'product_details'})
+    print(f"Found {from_description.sum()} CVEs with language determined from description")
 
     return _df
 
 
-if output_file_path.exists():
-    df = pd.read_csv(output_file_path)
-else:
-    _product_details = get_product_details_df(
-        product_lang_df_path=data_path / "products_language.csv", product_sw_type_df_path=data_path / "software_type.csv"
-    )
-    _cve_cwe_df = pd.read_csv(data_path / "cve_ids_in_apps_with_cwe.csv")
+if __name__ == "__main__":
+    if output_file_path.exists():
+        df = pd.read_csv(output_file_path)
+    else:
+        _product_details = get_product_details_df(
+            product_lang_df_path=data_path / "products_language.csv",
+            product_sw_type_df_path=data_path / "software_type.csv"
+        )
+        _cve_cwe_df = pd.read_csv(data_path / "cve_ids_in_apps_with_cwe.csv")
 
-    df = create_dataset_df(
-        nvd_data_path=Path("~/.nvdutils/nvd-json-data-feeds"), cve_cwe_df=_cve_cwe_df, product_details=_product_details
-    )
+        df = create_dataset_df(
+            nvd_data_path=Path("~/.nvdutils/nvd-json-data-feeds"), cve_cwe_df=_cve_cwe_df,
+            product_details=_product_details, workers=cpu_count() or 1
+        )
 
-    df.to_csv(output_file_path, index=False)
+        df.to_csv(output_file_path, index=False)
 
-counts = df[["software_type", "language", "cwe_id"]].value_counts()
-top_25_counts = counts.head(25)
+    counts = df[["software_type", "language", "cwe_id"]].value_counts()
+    top_25_counts = counts.head(25)
 
-print(f"Top 25 Relationship Counts:\n{top_25_counts}")
+    print(f"Top 25 Relationship Counts:\n{top_25_counts}")
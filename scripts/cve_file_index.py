@@ -0,0 +1,206 @@
+import os
+import sqlite3
+import subprocess
+
+from pathlib import Path
+from typing import Optional, Iterator, Tuple, Dict, Iterable
+
+
+class CVEFileIndex:
+    """
+        Persisted index of the CVE files in the NVD JSON data feeds, mapping CVE IDs to their relative path, size and
+        last-modified time. The index is stored in an SQLite file next to the feed and is updated incrementally: from
+        the git diff since the last indexed commit when the feed is a git repository, otherwise by rescanning only the
+        directories whose last-modified time changed.
+    """
+
+    def __init__(self, nvd_data_path: Path, index_path: Path = None):
+        self.nvd_data_path = nvd_data_path.expanduser()
+
+        if index_path is None:
+            index_path = self.nvd_data_path.parent / f"{self.nvd_data_path.name}.index.sqlite"
+
+        self.index_path = index_path
+        self.conn = sqlite3.connect(self.index_path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                cve_id TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL, dir TEXT
+            );
+            CREATE INDEX IF NOT EXISTS files_path ON files (path);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+            CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, mtime REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """
+        )
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def __contains__(self, cve_id: str) -> bool:
+        return self.get(cve_id) is not None
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, cve_id: str) -> Optional[Path]:
+        row = self.conn.execute("SELECT path FROM files WHERE cve_id = ?", (cve_id,)).fetchone()
+
+        return self.nvd_data_path / row[0] if row else None
+
+    def get_paths(self, cve_ids: Iterable[str]) -> Dict[str, Path]:
+        """
+            Looks up the files of the given CVE IDs; IDs that are not in the index are left out.
+        """
+        paths = {}
+
+        for cve_id in cve_ids:
+            path = self.get(cve_id)
+
+            if path is not None:
+                paths[cve_id] = path
+
+        return paths
+
+    def items(self) -> Iterator[Tuple[str, Path, int, float]]:
+        """
+            Iterates the (cve_id, path, size, mtime) entries, in directory order.
+        """
+        for cve_id, path, size, mtime in self.conn.execute("SELECT cve_id, path, size, mtime FROM files ORDER BY path"):
+            yield cve_id, self.nvd_data_path / path, size, mtime
+
+    def update(self) -> int:
+        """
+            Brings the index up to date with the feed.
+
+            Returns:
+                The number of files added, changed or removed.
+        """
+        head = self._get_git_head()
+        last_commit = self._get_meta('commit')
+        changes = None
+
+        if head and last_commit:
+            changes = self._update_from_git_diff(last_commit, head)
+
+        if changes is None:
+            changes = self._update_from_directories()
+
+        if head:
+            self._set_meta('commit', head)
+
+        self.conn.commit()
+
+        return changes
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _git(self, *args: str) -> Optional[str]:
+        if not (self.nvd_data_path / ".git").exists():
+            return None
+
+        result = subprocess.run(["git", "-C", str(self.nvd_data_path), *args], capture_output=True, text=True)
+
+        return result.stdout if result.returncode == 0 else None
+
+    def _get_git_head(self) -> Optional[str]:
+        head = self._git("rev-parse", "HEAD")
+
+        return head.strip() if head else None
+
+    def _upsert_file(self, relative_path: str, stat_result: os.stat_result):
+        # dir is the prefix of the files of a directory: its relative path and a '/', or '' for the root
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (cve_id, path, size, mtime, dir) VALUES (?, ?, ?, ?, ?)",
+            (
+                Path(relative_path).stem, relative_path, stat_result.st_size, stat_result.st_mtime,
+                relative_path[:relative_path.rfind('/') + 1]
+            )
+        )
+
+    def _update_from_git_diff(self, last_commit: str, head: str) -> Optional[int]:
+        if last_commit == head:
+            return 0
+
+        diff = self._git("diff", "--name-status", "--no-renames", last_commit, head, "--", "*CVE*.json")
+
+        if diff is None:
+            # e.g., the last indexed commit is no longer available
+            return None
+
+        changes = 0
+
+        for line in diff.splitlines():
+            status, relative_path = line.split("\t", 1)
+            changes += 1
+
+            if status == 'D':
+                self.conn.execute("DELETE FROM files WHERE path = ?", (relative_path,))
+            else:
+                self._upsert_file(relative_path, (self.nvd_data_path / relative_path).stat())
+
+        return changes
+
+    def _update_from_directories(self) -> int:
+        known_dirs = dict(self.conn.execute("SELECT path, mtime FROM directories"))
+        seen_dirs = set()
+        changes = 0
+        stack = [self.nvd_data_path]
+
+        # only directories are stat'ed; files are listed only in directories with a new last-modified time
+        while stack:
+            dir_path = stack.pop()
+            relative_dir = dir_path.relative_to(self.nvd_data_path).as_posix()
+            dir_mtime = dir_path.stat().st_mtime
+            seen_dirs.add(relative_dir)
+            changed = known_dirs.get(relative_dir) != dir_mtime
+            files = {}
+
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name != ".git":
+                            stack.append(Path(entry.path))
+                    elif changed and entry.name.startswith("CVE") and entry.name.endswith(".json"):
+                        files[entry.name] = entry
+
+            if not changed:
+                continue
+
+            changes += self._sync_directory(relative_dir, files)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO directories (path, mtime) VALUES (?, ?)", (relative_dir, dir_mtime)
+            )
+
+        for relative_dir in set(known_dirs) - seen_dirs:
+            changes += self._sync_directory(relative_dir, {})
+            self.conn.execute("DELETE FROM directories WHERE path = ?", (relative_dir,))
+
+        return changes
+
+    def _sync_directory(self, relative_dir: str, files: Dict[str, os.DirEntry]) -> int:
+        prefix = "" if relative_dir == "." else f"{relative_dir}/"
+        indexed = {
+            path[len(prefix):]: (size, mtime)
+            for path, size, mtime in self.conn.execute("SELECT path, size, mtime FROM files WHERE dir = ?", (prefix,))
+        }
+        changes = 0
+
+        for name in set(indexed) - set(files):
+            self.conn.execute("DELETE FROM files WHERE path = ?", (f"{prefix}{name}",))
+            changes += 1
+
+        for name, entry in files.items():
+            stat_result = entry.stat()
+
+            if indexed.get(name) != (stat_result.st_size, stat_result.st_mtime):
+                self._upsert_file(f"{prefix}{name}", stat_result)
+                changes += 1
+
+        return changes
@@ -1,26 +1,38 @@
+import json
+import hashlib
+import numpy as np
 import pandas as pd
 
+from tqdm import tqdm
+from os import cpu_count
 from pathlib import Path
-from typing import Optional, Dict
-from dataclasses import dataclass, field
+from itertools import groupby
+from typing import Optional, Dict, List, Tuple
+from dataclasses import dataclass, field, asdict
+from concurrent.futures import ProcessPoolExecutor
 
+from lxml import etree
 from pydantic_cwe.loader import Loader
-from pydantic_cwe.models import Weakness
 from cpelib.types.definitions import CPEPart
 
 from nvdutils.common.enums.weaknesses import WeaknessType
-from nvdutils.loaders.json.default import JSONDefaultLoader
 
+from nvdutils.models.cve import CVE
 from nvdutils.models.weaknesses import Weaknesses as NVDWeaknesses
 from nvdutils.data.criteria.cve import CVECriteria
 from nvdutils.data.profiles.base import BaseProfile
 from nvdutils.data.criteria.weaknesses import CWECriteria, WeaknessesCriteria
 from nvdutils.data.criteria.configurations import AffectedProductCriteria, ConfigurationsCriteria
 
+from cve_file_index import CVEFileIndex
+
 
 root_path = Path(__file__).parent.parent
 data_path = root_path / "data"
 output_file_path = data_path / "rq1" / "cve_ids_in_apps_with_cwe.csv"
+nvd_data_path = Path("~/.nvdutils/nvd-json-data-feeds").expanduser()
+# per CVE file: content hash, last-modified time and the row it produced; kept next to the feed it describes
+manifest_file_path = nvd_data_path.parent / "cve_ids_in_apps_with_cwe_manifest.json"
 
 weakness_criteria = WeaknessesCriteria(
     cwe_criteria=CWECriteria(),
@@ -73,6 +85,10 @@ SOFTWARE_ATTACK_PATTERN_IDS = {
     594, 595, 596, 607, 582, 584, 603, 589, 590, 96, 690, 691, 692, 693
 }
 
+# maximum number of files per shard of the parallel scan; recent years have tens of thousands of CVE files, so a shard
+# per year would leave most workers idle while the largest years are scanned
+FEED_SHARD_SIZE = 2000
+
 
 @dataclass
 class CVEInAppWithCWEProfile(BaseProfile):
@@ -84,8 +100,47 @@ class CVEInAppWithCWEProfile(BaseProfile):
     weakness_criteria: WeaknessesCriteria = field(default_factory=lambda: weakness_criteria)
 
 
-def get_code_related_weaknesses() -> Dict[int, Weakness]:
+@dataclass
+class CWEProperties:
+    """
+        Subset of a code-related weakness needed for selecting CWE IDs; small enough to be cached on disk and passed to
+        worker processes instead of the pydantic models.
+    """
+    abstraction: str
+    usage: str
+    flags: List[str] = field(default_factory=list)
+
+
+def get_cwe_catalog_version(xml_file: Path) -> str:
+    # the version is an attribute of the root element, so the rest of the catalog is not parsed
+    for _, element in etree.iterparse(str(xml_file), events=("start",)):
+        return element.get("Version")
+
+
+def get_code_related_weaknesses_key(xml_file: Path) -> str:
+    criteria = json.dumps([
+        sorted(TARGET_VULNERABILITY_MAPPINGS), sorted(TARGET_DETECTION_METHODS), sorted(SOFTWARE_ATTACK_PATTERN_IDS)
+    ])
+
+    return f"{get_cwe_catalog_version(xml_file)}-{hashlib.sha1(criteria.encode()).hexdigest()}"
+
+
+def get_code_related_weaknesses() -> Dict[int, CWEProperties]:
+    """
+        Filters the CWE catalog for code-related weaknesses. The result is cached next to the catalog and reused while
+        the catalog version and the filtering criteria stay the same, which skips building the pydantic catalog.
+    """
     cwe_loader = Loader()
+    cache_path = cwe_loader.xml_file.parent / "code_related_weaknesses.json"
+    cache_key = get_code_related_weaknesses_key(cwe_loader.xml_file)
+
+    if cache_path.exists():
+        with cache_path.open('r') as f:
+            cache = json.load(f)
+
+        if cache['key'] == cache_key:
+            return {int(cwe_id): CWEProperties(**properties) for cwe_id, properties in cache['weaknesses'].items()}
+
     catalog = cwe_loader.load()
 
     weaknesses = {}
@@ -108,12 +163,26 @@ def get_code_related_weaknesses() -> Dict[int, Weakness]:
 
         if has_implementation_in_introductions or has_implementation_in_mitigations:
             if has_code_examples or has_detection_methods or has_software_attack_pattern:
-                weaknesses[weakness.id] = weakness
+                flags = {
+                    'implementation_in_introductions': has_implementation_in_introductions,
+                    'implementation_in_mitigations': has_implementation_in_mitigations,
+                    'code_examples': has_code_examples,
+                    'detection_methods': has_detection_methods,
+                    'software_attack_pattern': has_software_attack_pattern
+                }
+                weaknesses[weakness.id] = CWEProperties(
+                    abstraction=weakness.abstraction,
+                    usage=weakness.mapping_notes['Usage'],
+                    flags=[flag for flag, value in flags.items() if value]
+                )
+
+    with cache_path.open('w') as f:
+        json.dump({'key': cache_key, 'weaknesses': {cwe_id: asdict(p) for cwe_id, p in weaknesses.items()}}, f)
 
     return weaknesses
 
 
-def select_cwe_id(weaknesses: NVDWeaknesses, cwe_properties: Dict[int, Weakness]) -> Optional[int]:
+def select_cwe_id(weaknesses: NVDWeaknesses, cwe_properties: Dict[int, CWEProperties]) -> Optional[int]:
     best_cwe = (None, -1)
 
     for weakness in weaknesses:
@@ -131,37 +200,284 @@ def select_cwe_id(weaknesses: NVDWeaknesses, cwe_properties: Dict[int, Weakness]
     return best_cwe[0]
 
 
-def get_cwe_ids_in_apps_with_cwe_df(nvd_data_path: Path) -> pd.DataFrame:
-    rows = []
-    loader = JSONDefaultLoader(profile=CVEInAppWithCWEProfile, verbose=True)
-    cwe_properties_dict = get_code_related_weaknesses()
+def get_cve_row(cve: CVE, cwe_properties: Dict[int, CWEProperties]) -> Optional[dict]:
+    cwe_id = select_cwe_id(weaknesses=cve.weaknesses, cwe_properties=cwe_properties)
+
+    if not cwe_id:
+        return None
+
+    return {
+        'cve_id': cve.id,
+        'cwe_id': f"CWE-{cwe_id}"
+    }
+
+
+def flatten_weaknesses(weaknesses: NVDWeaknesses) -> List[Tuple[int, str]]:
+    # (cwe_id, weakness_type) pairs in the order select_cwe_id visits them
+    return [(cwe_id, weakness.type.name) for weakness in weaknesses for cwe_id in weakness.ids]
+
+
+def cve_id_sort_key(cve_id: str) -> Tuple[int, int]:
+    _, year, number = cve_id.split("-")
+
+    return int(year), int(number)
+
+
+# set once per worker process by init_scan_worker, so the catalog is not pickled with every shard
+_scan_cwe_properties: Dict[int, CWEProperties] = {}
+
+
+def init_scan_worker(cwe_properties: Dict[int, CWEProperties]):
+    global _scan_cwe_properties
+    _scan_cwe_properties = cwe_properties
+
+
+def scan_cve_file(file_path: Path) -> dict:
+    """
+        Parses a CVE file and returns its manifest entry: content hash, last-modified time, the flattened weaknesses
+        and the row it produced (None when the CVE does not match the profile or has no code-related CWE).
+    """
+    content = file_path.read_bytes()
+    entry = {
+        'mtime': file_path.stat().st_mtime,
+        'hash': hashlib.sha1(content).hexdigest(),
+        'weaknesses': [],
+        'row': None
+    }
+
+    try:
+        cve = CVE(**json.loads(content))
+    except Exception as e:
+        print(f"Error parsing {file_path}: {e}")
+        return entry
+
+    if CVEInAppWithCWEProfile()(cve):
+        entry['weaknesses'] = flatten_weaknesses(cve.weaknesses)
+        entry['row'] = get_cve_row(cve, _scan_cwe_properties)
+
+    return entry
+
+
+def scan_files(file_paths: List[Path]) -> Dict[str, dict]:
+    return {file_path.stem: scan_cve_file(file_path) for file_path in file_paths}
+
+
+def get_feed_shards(nvd_data_path: Path, file_paths: List[Path], shard_size: int = FEED_SHARD_SIZE) -> List[List[Path]]:
+    """
+        Splits the files by year directory (e.g., CVE-2021), and the files of each year into chunks of at most
+        shard_size files, in a deterministic order.
+    """
+    def year_dir(file_path: Path) -> str:
+        return file_path.relative_to(nvd_data_path.expanduser()).parts[0]
+
+    shards = []
+
+    for _, files in groupby(sorted(file_paths, key=lambda x: (year_dir(x), x.name)), key=year_dir):
+        files = list(files)
+        shards.extend(files[i:i + shard_size] for i in range(0, len(files), shard_size))
+
+    return shards
+
+
+def scan_feed_files(nvd_data_path: Path, file_paths: List[Path], cwe_properties: Dict[int, CWEProperties],
+                    workers: int = 1) -> Dict[str, dict]:
+    """
+        Parses the given CVE files into manifest entries. With more than one worker, the files are split by year
+        directory into shards of at most FEED_SHARD_SIZE files, which are scanned in a process pool.
+    """
+    entries = {}
+
+    if workers > 1:
+        shards = get_feed_shards(nvd_data_path, file_paths)
+
+        with ProcessPoolExecutor(
+                max_workers=workers, initializer=init_scan_worker, initargs=(cwe_properties,)
+        ) as executor:
+            for shard_entries in tqdm(executor.map(scan_files, shards), total=len(shards), desc="Scanning feed shards"):
+                entries.update(shard_entries)
+    else:
+        init_scan_worker(cwe_properties)
+
+        for file_path in tqdm(file_paths, desc="Scanning CVE files"):
+            entries[file_path.stem] = scan_cve_file(file_path)
+
+    return entries
 
-    for entry in loader(data_path=nvd_data_path, include_subdirectories=True):
-        cwe_id = select_cwe_id(weaknesses=entry.weaknesses, cwe_properties=cwe_properties_dict)
 
-        if not cwe_id:
+def get_cwe_selection_key(xml_file: Path) -> str:
+    """
+        Identifies everything the stored rows depend on besides the CVE files: the catalog version, the filtering
+        criteria of the code-related weaknesses and the abstraction scores.
+    """
+    scores = json.dumps(CWE_ABSTRACTION_SCORE, sort_keys=True)
+
+    return f"{get_code_related_weaknesses_key(xml_file)}-{hashlib.sha1(scores.encode()).hexdigest()}"
+
+
+def load_manifest(manifest_path: Path) -> dict:
+    """
+        Returns the manifest as {'key': CWE selection key of the rows, 'entries': {cve_id: entry}}.
+    """
+    if not manifest_path.exists():
+        return {'key': None, 'entries': {}}
+
+    with manifest_path.open('r') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, manifest_path: Path):
+    with manifest_path.open('w') as f:
+        json.dump(manifest, f)
+
+
+def update_manifest(nvd_data_path: Path, manifest: dict, workers: int = 1) -> int:
+    """
+        Brings the manifest up to date with the feed: entries of removed files are dropped, files with a new
+        last-modified time are hashed and only the new or changed ones are reparsed. An empty manifest amounts to a
+        full rebuild. When the CWE catalog, the filtering criteria or the abstraction scores changed since the rows
+        were stored, the rows of all entries are recomputed from their stored weaknesses with select_cwe_ids.
+
+        Returns:
+            The number of entries added, changed, touched, re-scored or removed; 0 if the manifest is unchanged.
+    """
+    entries = manifest['entries']
+    cve_file_index = CVEFileIndex(nvd_data_path)
+    cve_file_index.update()
+    # the last-modified times come from the index, so unchanged files are not stat'ed
+    files = {cve_id: (file_path, mtime) for cve_id, file_path, _, mtime in cve_file_index.items()}
+    cve_file_index.close()
+    removed = [cve_id for cve_id in entries if cve_id not in files]
+
+    for cve_id in removed:
+        del entries[cve_id]
+
+    to_parse = []
+    touched = 0
+
+    for cve_id, (file_path, mtime) in files.items():
+        entry = entries.get(cve_id)
+
+        if entry is None:
+            to_parse.append(file_path)
+            continue
+
+        if entry['mtime'] == mtime:
             continue
 
-        rows.append({
-            'cve_id': entry.id,
-            'cwe_id': f"CWE-{cwe_id}"
-        })
+        if entry['hash'] == hashlib.sha1(file_path.read_bytes()).hexdigest():
+            # touched but not changed; counted so the new time is saved and the file is not hashed again
+            entry['mtime'] = mtime
+            touched += 1
+        else:
+            to_parse.append(file_path)
+
+    selection_key = get_cwe_selection_key(Loader().xml_file)
+    rescore = bool(entries) and manifest['key'] != selection_key
+    print(f"Found {len(files)} CVE files: {len(to_parse)} new or changed, {len(removed)} removed, {touched} touched"
+          f"{', CWE selection changed' if rescore else ''}")
+
+    if not to_parse and not rescore:
+        return len(removed) + touched
+
+    cwe_properties_dict = get_code_related_weaknesses()
+
+    if to_parse:
+        entries.update(scan_feed_files(nvd_data_path, to_parse, cwe_properties_dict, workers=workers))
+
+    if rescore:
+        rows_df = select_cwe_ids(get_cve_weaknesses_df(entries), cwe_properties_dict)
+        rows = {row['cve_id']: row for row in rows_df.to_dict('records')}
+
+        for cve_id, entry in entries.items():
+            entry['row'] = rows.get(cve_id)
+
+    manifest['key'] = selection_key
+
+    return len(to_parse) + len(removed) + touched + (len(entries) if rescore else 0)
+
+
+def get_manifest_df(entries: Dict[str, dict]) -> pd.DataFrame:
+    rows = [entry['row'] for entry in entries.values() if entry['row']]
+    rows.sort(key=lambda x: cve_id_sort_key(x['cve_id']))
+
+    return pd.DataFrame(rows, columns=['cve_id', 'cwe_id'])
+
+
+def get_cve_weaknesses_df(entries: Dict[str, dict]) -> pd.DataFrame:
+    """
+        Flattens the weaknesses of all CVEs in the manifest entries into one (cve_id, cwe_id, weakness_type) table,
+        sorted by CVE year and number.
+    """
+    records = [
+        (cve_id, cwe_id, weakness_type)
+        for cve_id in sorted(entries, key=cve_id_sort_key)
+        for cwe_id, weakness_type in entries[cve_id]['weaknesses']
+    ]
+
+    return pd.DataFrame(records, columns=['cve_id', 'cwe_id', 'weakness_type'])
+
+
+def select_cwe_ids(cve_weaknesses_df: pd.DataFrame, cwe_properties: Dict[int, CWEProperties],
+                   abstraction_score: Dict[str, int] = None) -> pd.DataFrame:
+    """
+        Vectorized select_cwe_id over the flattened CVE-weakness table, which makes re-scoring with other weights cheap.
+        The score is looked up in an array indexed by CWE ID, and the first row with the highest score wins, as in the
+        loop.
+
+        Returns:
+            DataFrame with the (cve_id, cwe_id) rows, in the order of the table
+    """
+    if abstraction_score is None:
+        abstraction_score = CWE_ABSTRACTION_SCORE
+
+    score_array = np.full(max(cwe_properties, default=0) + 1, np.nan)
+
+    for cwe_id, properties in cwe_properties.items():
+        score_array[cwe_id] = abstraction_score[properties.abstraction]
+
+    cwe_ids = cve_weaknesses_df['cwe_id'].to_numpy(dtype=np.int64)
+    known = cwe_ids < len(score_array)
+    scores = np.full(len(cwe_ids), np.nan)
+    scores[known] = score_array[cwe_ids[known]]
+    scores += (cve_weaknesses_df['weakness_type'] == WeaknessType.Primary.name).to_numpy()
+
+    scored_df = cve_weaknesses_df.assign(score=scores).dropna(subset=['score'])
+    # idxmax keeps the first occurrence of the maximum, matching the strict comparison in select_cwe_id
+    best_df = scored_df.loc[scored_df.groupby('cve_id', sort=False)['score'].idxmax(), ['cve_id', 'cwe_id']]
+    best_df['cwe_id'] = "CWE-" + best_df['cwe_id'].astype(str)
+
+    return best_df.reset_index(drop=True)
+
+
+def get_cwe_ids_in_apps_with_cwe_df(nvd_data_path: Path, manifest_path: Path, workers: int = 1) -> pd.DataFrame:
+    """
+        Extracts the (cve_id, cwe_id) rows from the NVD feed, reparsing only the CVE files that changed since the last
+        run recorded in the manifest. Rows are sorted by CVE year and number.
+    """
+    manifest = load_manifest(manifest_path)
+
+    if update_manifest(nvd_data_path, manifest, workers=workers):
+        save_manifest(manifest, manifest_path)
 
-    _df = pd.DataFrame(rows)
+    _df = get_manifest_df(manifest['entries'])
     print(f"Found {len(_df)} CVEs with CWEs")
 
     return _df
 
 
-if output_file_path.exists():
-    df = pd.read_csv(output_file_path)
-else:
-    df = get_cwe_ids_in_apps_with_cwe_df(nvd_data_path=Path("~/.nvdutils/nvd-json-data-feeds"))
-    df.to_csv(output_file_path, index=False)
+if __name__ == "__main__":
+    if output_file_path.exists() and not manifest_file_path.exists():
+        # without a manifest the CSV can only be reused as a whole; remove it to rebuild and start tracking the feed
+        df = pd.read_csv(output_file_path)
+    else:
+        df = get_cwe_ids_in_apps_with_cwe_df(
+            nvd_data_path=nvd_data_path, manifest_path=manifest_file_path, workers=cpu_count() or 1
+        )
+        df.to_csv(output_file_path, index=False)
 
-print(f"Unique CWE-IDs: {len(df['cwe_id'].unique())}")
-counts = df['cwe_id'].value_counts()
-top_25 = counts.head(25)
+    print(f"Unique CWE-IDs: {len(df['cwe_id'].unique())}")
+    counts = df['cwe_id'].value_counts()
+    top_25 = counts.head(25)
 
-print(f"Top 25 CWEs: {top_25}")
-print(f"Top 25 Percentage: {top_25.sum() / counts.sum()}")
+    print(f"Top 25 CWEs: {top_25}")
+    print(f"Top 25 Percentage: {top_25.sum() / counts.sum()}")
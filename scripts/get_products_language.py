@@ -1,19 +1,26 @@
+import re
 import sqlite3
+import hashlib
 import pandas as pd
 import logging
 import sys
 import json
 
 from tqdm import tqdm
-from os import environ
-from typing import List, Set, Optional, Tuple
+from os import environ, cpu_count
+from typing import List, Optional, Tuple, Dict, Callable, Iterable, Iterator
 from pathlib import Path
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
-from gitlib import GitClient
-from gitlib.common.exceptions import GitLibException
 from cpeparser import CpeParser
 from packageurl import PackageURL
 
+from github_client import GitHubClient, GitHubClientError
+from repository_languages_cache import RepositoryLanguagesCache
+from checkpoint_journal import CheckpointJournal
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -47,13 +54,55 @@ PURL_TYPE_LANGUAGE_MAPPING = {
     "eclipse": "Java"
 }
 
+# Number of purl2cpe rows fetched at a time, and size of the memory map of the purl2cpe database
+PURL2CPE_FETCH_SIZE = 10000
+PURL2CPE_MMAP_SIZE = 256 * 2 ** 20
+
+# Number of purl-cpe pairs parsed per chunk when parsing in parallel
+PURL_CPE_CHUNK_SIZE = 50000
+
+# Well-formed CPE 2.3 and purl strings that the fast path parses; anything else (e.g., escaped characters,
+# percent-encoding, qualifiers) goes through CpeParser and PackageURL
+CPE_FAST_PATTERN = re.compile(r'cpe:2\.3:[^\\~]*')
+PURL_FAST_PATTERN = re.compile(
+    r'pkg:(?P<type>[a-z][a-z0-9._-]*)/(?:(?P<namespace>[A-Za-z0-9._-]+(?:/[A-Za-z0-9._-]+)*)/)?'
+    r'(?P<name>[A-Za-z0-9._-]+)(?:@(?P<version>[A-Za-z0-9._+~-]+))?'
+)
+CPE_ATTRIBUTES_COUNT = 11
+
+# purl normalization rules of packageurl for the types the fast path handles
+PURL_LOWERCASE_NAMESPACE_TYPES = {
+    "bitbucket", "github", "pypi", "gitlab", "composer", "luarocks", "qpkg", "alpm", "apk", "hex"
+}
+PURL_LOWERCASE_NAME_TYPES = {
+    "bitbucket", "github", "pypi", "gitlab", "composer", "luarocks", "npm", "alpm", "apk", "bitnami", "hex"
+}
+# types with normalization rules that depend on more than the type (or lowercase the version)
+PURL_SLOW_PATH_TYPES = {"mlflow", "pub", "oci", "huggingface"}
+
+# Number of concurrent GitHub API requests
+GITHUB_MAX_WORKERS = 8
+# Number of repositories per GitHub GraphQL query
+GITHUB_GRAPHQL_BATCH_SIZE = 50
+
+# Cache of repository languages: entries are fresh for 30 days (7 days for repositories not found) and evicted after
+# 180 days
+GITHUB_CACHE_PATH = Path("~/.cache/products_language/github_languages.sqlite")
+GITHUB_CACHE_TTL = 30 * 24 * 3600
+GITHUB_CACHE_NEGATIVE_TTL = 7 * 24 * 3600
+GITHUB_CACHE_MAX_AGE = 180 * 24 * 3600
+
+# Language updates from GitHub are checkpointed every 500 products or 30 seconds
+CHECKPOINT_EVERY = 500
+CHECKPOINT_INTERVAL = 30.0
+
 
 def initialize_clients():
     """
-    Initialize the CPE parser and Git client.
+    Initialize the CPE parser and GitHub client.
 
     Returns:
-        Tuple[CpeParser, GitClient]: Initialized CPE parser and Git client
+        Tuple[CpeParser, GitHubClient]: Initialized CPE parser and GitHub client
 
     Raises:
         ValueError: If GITHUB_TOKEN environment variable is not set
@@ -64,20 +113,52 @@ def initialize_clients():
     if not github_token:
         raise ValueError("GITHUB_TOKEN environment variable not set")
 
-    git_client = GitClient(github_token)
+    git_client = GitHubClient(github_token)
 
     return cpe_parser, git_client
 
 
-def load_purl2cpe_pairs(db_file: Path) -> List[tuple]:
+def connect_purl2cpe_db(db_file: Path, read_only: bool = True, mmap_size: int = PURL2CPE_MMAP_SIZE) -> sqlite3.Connection:
     """
-    Connects to the SQLite database and retrieves all (purl, cpe) pairs.
+    Connect to the purl2cpe SQLite database.
 
     Args:
         db_file: Path to the SQLite database file
+        read_only: Whether to open the database in read-only mode
+        mmap_size: Maximum number of bytes of the database to memory-map (0 disables memory-mapped I/O)
 
     Returns:
-        List of (purl, cpe) tuples
+        Connection to the database
+    """
+    if read_only:
+        conn = sqlite3.connect(f"{Path(db_file).expanduser().resolve().as_uri()}?mode=ro", uri=True)
+    else:
+        conn = sqlite3.connect(db_file)
+
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+
+    return conn
+
+
+def iter_purl2cpe_pairs(
+        db_file: Path, applications_only: bool = False, purl_types: Optional[Iterable[str]] = None,
+        fetch_size: int = PURL2CPE_FETCH_SIZE, read_only: bool = True, mmap_size: int = PURL2CPE_MMAP_SIZE
+) -> Iterator[tuple]:
+    """
+    Connects to the SQLite database and streams the (purl, cpe) pairs, fetch_size rows at a time.
+
+    The optional filters are evaluated by SQLite, so the rows they exclude are never loaded.
+
+    Args:
+        db_file: Path to the SQLite database file
+        applications_only: Only include application CPEs (cpe:2.3:a:...)
+        purl_types: Only include purls of these types (e.g., PURL_TYPE_LANGUAGE_MAPPING keys and 'github')
+        fetch_size: Number of rows fetched at a time
+        read_only: Whether to open the database in read-only mode
+        mmap_size: Maximum number of bytes of the database to memory-map
+
+    Yields:
+        (purl, cpe) tuples
 
     Raises:
         ValueError: If no database file is specified
@@ -85,138 +166,230 @@ def load_purl2cpe_pairs(db_file: Path) -> List[tuple]:
     if not db_file:
         raise ValueError("No database file specified.")
 
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-    _pairs = []
+    query = "SELECT purl, cpe FROM purl2cpe"
+    conditions = []
+    parameters = []
+
+    if applications_only:
+        conditions.append("cpe LIKE 'cpe:2.3:a:%'")
+
+    if purl_types is not None:
+        purl_types = sorted(set(purl_types))
+        conditions.append(f"({' OR '.join(['purl LIKE ?'] * len(purl_types)) or '0'})")
+        parameters.extend(f"pkg:{purl_type}/%" for purl_type in purl_types)
+
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+
+    conn = connect_purl2cpe_db(db_file, read_only, mmap_size)
+    count = 0
 
     try:
-        cursor.execute("SELECT purl, cpe FROM purl2cpe;")
-        _pairs = cursor.fetchall()
-        logger.info(f"Loaded {len(_pairs)} purl-cpe pairs from database")
+        cursor = conn.execute(query, parameters)
+
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+
+            if not rows:
+                break
+
+            count += len(rows)
+            yield from rows
+
+        logger.info(f"Loaded {count} purl-cpe pairs from database")
     except sqlite3.Error as e:
         logger.error(f"Database error: {e}")
         raise
     finally:
         conn.close()
 
-    return _pairs
 
+def parse_cpe_vendor_product(cpe: str, cpe_parser: CpeParser) -> Tuple[str, str]:
+    """
+    Get the vendor and product of a CPE, with a split-based fast path for well-formed CPE 2.3 strings without escaped
+    characters. Other strings are parsed with CpeParser, so the result is the same.
+
+    Args:
+        cpe: CPE string
+        cpe_parser: Initialized CPE parser
+
+    Returns:
+        Tuple of (vendor, product)
 
-def get_vendor_product_purl_df(purl_cpe_pairs: List[tuple], cpe_parser: CpeParser) -> pd.DataFrame:
+    Raises:
+        Exception: If CpeParser fails to parse the CPE
     """
-    Create a DataFrame with vendor-product-purl mappings from purl-cpe pairs.
+    cpe = cpe.strip().lower()
+
+    if CPE_FAST_PATTERN.fullmatch(cpe):
+        attributes = cpe[8:].split(":")
+
+        if len(attributes) >= CPE_ATTRIBUTES_COUNT:
+            # CpeParser replaces empty attributes with '*'
+            return attributes[1] or "*", attributes[2] or "*"
+
+    cpe_obj = cpe_parser.parser(cpe)
+
+    return cpe_obj['vendor'], cpe_obj['product']
+
+
+def parse_purl(purl: str) -> dict:
+    """
+    Get the components of a purl, as PackageURL.from_string(purl).to_dict(), with a regex-based fast path for purls
+    without qualifiers, subpath or encoded characters.
+
+    Args:
+        purl: Package URL string
+
+    Returns:
+        Dictionary with the type, namespace, name, version, qualifiers and subpath of the purl
+
+    Raises:
+        ValueError: If the purl is invalid
+    """
+    match = PURL_FAST_PATTERN.fullmatch(purl)
+
+    if match is None or match.group('type') in PURL_SLOW_PATH_TYPES:
+        return PackageURL.from_string(purl).to_dict()
+
+    purl_type, namespace, name, version = match.group('type', 'namespace', 'name', 'version')
+
+    if namespace is not None:
+        if purl_type in PURL_LOWERCASE_NAMESPACE_TYPES:
+            namespace = namespace.lower()
+        elif purl_type == "cpan":
+            namespace = namespace.upper()
+
+    if purl_type in PURL_LOWERCASE_NAME_TYPES:
+        name = name.lower()
+
+    if purl_type in ("pypi", "hackage"):
+        name = name.replace("_", "-")
+
+    return {
+        "type": purl_type, "namespace": namespace, "name": name, "version": version, "qualifiers": None,
+        "subpath": None
+    }
+
+
+def parse_purl_cpe_pairs(purl_cpe_pairs: List[tuple], cpe_parser: CpeParser) -> List[dict]:
+    """
+    Parse purl-cpe pairs into vendor-product-purl rows, skipping the pairs that fail to parse.
 
     Args:
         purl_cpe_pairs: List of (purl, cpe) tuples
         cpe_parser: Initialized CPE parser
 
     Returns:
-        DataFrame with vendor-product-purl mappings
+        List of rows with the purl components, vendor and product
     """
     rows = []
 
-    for purl, cpe in tqdm(purl_cpe_pairs, desc="Processing purl-cpe pairs"):
+    for purl, cpe in purl_cpe_pairs:
         try:
-            cpe_obj = cpe_parser.parser(cpe)
+            vendor, product = parse_cpe_vendor_product(cpe, cpe_parser)
         except Exception as e:
             logger.warning(f"Error parsing CPE: {cpe}, Error: {e}")
             continue
 
         try:
-            purl_obj = PackageURL.from_string(purl)
+            row = parse_purl(purl)
         except ValueError as e:
             logger.debug(f"Error parsing purl: {purl}, Error: {e}")
             continue
 
-        row = purl_obj.to_dict()
-        row.update({"vendor": cpe_obj['vendor'], "product": cpe_obj['product']})
+        row.update({"vendor": vendor, "product": product})
         rows.append(row)
 
-    mappings_df = pd.DataFrame(rows)
-    mappings_df.drop_duplicates(subset=["vendor", "product"], inplace=True)
-    logger.info(f"Found {len(mappings_df)} vendor-product-repo mappings")
-
-    return mappings_df
+    return rows
 
 
-def determine_language_from_purl_type(purl_types: Set[str]) -> Tuple[Optional[str], Optional[str]]:
+def get_vendor_product_purl_df(purl_cpe_pairs: Iterable[tuple], cpe_parser: CpeParser, workers: int = 1,
+                               chunk_size: int = PURL_CPE_CHUNK_SIZE) -> pd.DataFrame:
     """
-    Determine the programming language based on package URL types.
-
-    Args:
-        purl_types: Set of package URL types
-
-    Returns:
-        Tuple of (selected_type, language)
-    """
-    intersection = purl_types.intersection(list(PURL_TYPE_LANGUAGE_MAPPING.keys()))
-    selected_type = None
-    language = None
-
-    # Determine language based on package type
-    if len(intersection) == 1:
-        selected_type = intersection.pop()
-        language = PURL_TYPE_LANGUAGE_MAPPING[selected_type]
-    elif len(intersection) > 1:
-        logger.info(f"Found multiple purl types: {list(intersection)}")
-
-    return selected_type, language
-
+    Create a DataFrame with vendor-product-purl mappings from purl-cpe pairs.
 
-def select_row_for_product(rows: pd.DataFrame, purl_types: Set[str], selected_type: Optional[str]) -> Optional[dict]:
-    """
-    Select the most appropriate row for a product based on package type.
+    With more than one worker, the pairs are parsed in chunks across a process pool. At most two chunks per worker are
+    in flight, so the pairs are still streamed, and the rows keep the order of the pairs.
 
     Args:
-        rows: DataFrame rows for a specific vendor-product pair
-        purl_types: Set of package URL types
-        selected_type: Selected package type for language determination
+        purl_cpe_pairs: Iterable of (purl, cpe) tuples
+        cpe_parser: Initialized CPE parser
+        workers: Number of worker processes; 1 parses in the current process
+        chunk_size: Number of pairs per chunk
 
     Returns:
-        Selected row as a dictionary or None if no suitable row found
+        DataFrame with vendor-product-purl mappings
     """
-    # Prefer GitHub repositories
-    if 'github' in purl_types:
-        return rows[rows['type'] == 'github'].iloc[0].to_dict()
+    rows = []
+    pairs = iter(purl_cpe_pairs)
+    chunks = iter(lambda: list(islice(pairs, chunk_size)), [])
+    progress = tqdm(desc="Processing purl-cpe pairs")
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+
+            for chunk in chunks:
+                pending.append((executor.submit(parse_purl_cpe_pairs, chunk, cpe_parser), len(chunk)))
+
+                while len(pending) >= 2 * workers or (pending and pending[0][0].done()):
+                    future, size = pending.popleft()
+                    rows.extend(future.result())
+                    progress.update(size)
+
+            while pending:
+                future, size = pending.popleft()
+                rows.extend(future.result())
+                progress.update(size)
+    else:
+        for chunk in chunks:
+            rows.extend(parse_purl_cpe_pairs(chunk, cpe_parser))
+            progress.update(len(chunk))
 
-    # If we have a selected type, use that
-    if selected_type:
-        return rows[rows['type'] == selected_type].iloc[0].to_dict()
+    progress.close()
 
-    return None
+    mappings_df = pd.DataFrame(rows)
+    mappings_df.drop_duplicates(subset=["vendor", "product"], inplace=True)
+    logger.info(f"Found {len(mappings_df)} vendor-product-repo mappings")
+
+    return mappings_df
 
 
 def map_pkg_to_language(purl_cpe_df: pd.DataFrame) -> pd.DataFrame:
     """
     Map packages to programming languages using package type information.
 
+    For each vendor-product pair, the language is the one of its package type in PURL_TYPE_LANGUAGE_MAPPING, if
+    exactly one of its package types is mapped. The row kept for the pair is its first GitHub repository, otherwise
+    its first package of the mapped type; pairs with neither are skipped. The pairs are in sorted order.
+
     Args:
         purl_cpe_df: DataFrame with vendor-product-purl mappings
 
     Returns:
         DataFrame with vendor-product-language mappings
     """
-    new_rows = []
-
-    for group, rows in tqdm(purl_cpe_df.groupby(["vendor", "product"]), 
-                           desc="Mapping packages to languages", 
-                           total=len(purl_cpe_df.groupby(["vendor", "product"]))):
-        purl_types = set(rows['type'].unique())
-
-        # Determine language based on package type
-        selected_type, language = determine_language_from_purl_type(purl_types)
-
-        # Select the most appropriate row
-        row = select_row_for_product(rows, purl_types, selected_type)
-
-        # Skip if no suitable row found
-        if not row:
-            continue
-
-        row['language'] = language
-        new_rows.append(row)
-
-    result_df = pd.DataFrame(new_rows)
+    purl_cpe_df = purl_cpe_df.dropna(subset=["vendor", "product"])
+    groups = [purl_cpe_df['vendor'], purl_cpe_df['product']]
+
+    # Determine language based on package type: the mapped package types of each pair
+    mapped_types = purl_cpe_df['type'].where(purl_cpe_df['type'].isin(PURL_TYPE_LANGUAGE_MAPPING.keys()))
+    mapped_types_count = mapped_types.groupby(groups).transform('nunique')
+    selected_types = mapped_types.groupby(groups).transform('first').where(mapped_types_count == 1)
+    multiple_types_count = purl_cpe_df.loc[mapped_types_count > 1, ['vendor', 'product']].drop_duplicates().shape[0]
+
+    if multiple_types_count:
+        logger.info(f"Found multiple purl types for {multiple_types_count} products")
+
+    # Select the most appropriate row: prefer GitHub repositories, otherwise the selected package type
+    is_github = purl_cpe_df['type'] == 'github'
+    has_github = is_github.groupby(groups).transform('any')
+    candidates = (has_github & is_github) | (~has_github & (purl_cpe_df['type'] == selected_types))
+
+    result_df = purl_cpe_df[candidates].drop_duplicates(subset=["vendor", "product"])
+    result_df = result_df.assign(language=selected_types[candidates].map(PURL_TYPE_LANGUAGE_MAPPING))
+    result_df = result_df.sort_values(["vendor", "product"], kind='stable', ignore_index=True)
     logger.info(f"Mapped {len(result_df)} products to languages")
 
     return result_df
@@ -234,8 +407,8 @@ def get_products_language_df(purl_db_path: Path, output_path: Path, cpe_parser:
     Returns:
         DataFrame with product-language mappings
     """
-    pairs = load_purl2cpe_pairs(purl_db_path)
-    product_purl_df = get_vendor_product_purl_df(pairs, cpe_parser)
+    pairs = iter_purl2cpe_pairs(purl_db_path)
+    product_purl_df = get_vendor_product_purl_df(pairs, cpe_parser, workers=cpu_count() or 1)
 
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug(f"Sample of product-purl mappings:\n{product_purl_df.head()}")
@@ -253,35 +426,68 @@ def get_products_language_df(purl_db_path: Path, output_path: Path, cpe_parser:
     return product_lang_df
 
 
-def get_repository_languages(git_client: GitClient, namespace: str, name: str) -> Optional[List[Tuple[str, int]]]:
+def sort_languages(languages_dict: Dict[str, int]) -> List[Tuple[str, int]]:
+    """
+    Sort the languages of a repository by byte count (descending).
+
+    Args:
+        languages_dict: Dictionary mapping languages to byte counts
+
+    Returns:
+        List of (language, byte_count) tuples sorted by byte count (descending)
+    """
+    return sorted(languages_dict.items(), key=lambda x: x[1], reverse=True)
+
+
+def get_repository_languages(
+        git_client: GitHubClient, namespace: str, name: str, cache: Optional[RepositoryLanguagesCache] = None
+) -> Optional[List[Tuple[str, int]]]:
     """
     Get sorted languages from a GitHub repository.
 
+    With a cache, fresh entries are returned without querying GitHub, and stale entries are revalidated with a
+    conditional request. Repositories without languages and repositories not found are cached too; errors are not.
+
     Args:
-        git_client: Initialized Git client
+        git_client: Initialized GitHub client
         namespace: Repository owner/namespace
         name: Repository name
+        cache: Cache of repository languages
 
     Returns:
         List of (language, byte_count) tuples sorted by byte count (descending) or None if error
     """
+    entry = cache.get(namespace, name) if cache is not None else None
+
+    if entry is not None and cache.is_fresh(entry):
+        return entry.languages or None
+
     try:
-        repo = git_client.get_repo(owner=namespace, project=name, raise_err=True)
-        languages_dict = repo.repo.get_languages()
+        modified, languages_dict, etag = git_client.get_languages_if_modified(
+            namespace, name, entry.etag if entry is not None else None
+        )
+
+        if not modified:
+            cache.touch(namespace, name)
+            return entry.languages or None
+
+        sorted_languages = sort_languages(languages_dict) if languages_dict is not None else None
+
+        if cache is not None:
+            cache.put(namespace, name, sorted_languages, etag)
+
+        if languages_dict is None:
+            logger.warning(f"GitHub repository not found or not accessible: {namespace}/{name}")
+            return None
 
         if not languages_dict:
             logger.debug(f"No languages found for {namespace}/{name}")
             return None
 
-        # Sort languages by byte count (descending)
-        return sorted(languages_dict.items(), key=lambda x: x[1], reverse=True)
-    except GitLibException as gle:
-        if 'limit exhausted' in str(gle):
-            logger.warning("GitHub API rate limit exhausted. Stopping queries.")
-            raise
-        else:
-            logger.warning(f"Error querying GitHub repository: {namespace}/{name}, Error: {gle}")
-            return None
+        return sorted_languages
+    except GitHubClientError as gce:
+        logger.warning(f"Error querying GitHub repository: {namespace}/{name}, Error: {gce}")
+        return None
     except Exception as e:
         logger.error(f"Unexpected error querying repository {namespace}/{name}: {e}")
         return None
@@ -333,7 +539,9 @@ def select_language_by_priority(sorted_languages: List[Tuple[str, int]], namespa
     return 'N/A'
 
 
-def query_github_repository_language(git_client: GitClient, namespace: str, name: str) -> Optional[str]:
+def query_github_repository_language(
+        git_client: GitHubClient, namespace: str, name: str, cache: Optional[RepositoryLanguagesCache] = None
+) -> Optional[str]:
     """
     Query GitHub API for repository language information.
 
@@ -343,83 +551,261 @@ def query_github_repository_language(git_client: GitClient, namespace: str, name
     If language still can't be verified, set it to 'N/A'.
 
     Args:
-        git_client: Initialized Git client
+        git_client: Initialized GitHub client
         namespace: Repository owner/namespace
         name: Repository name
+        cache: Cache of repository languages
 
     Returns:
         Repository language or 'N/A' if not available
     """
     try:
-        sorted_languages = get_repository_languages(git_client, namespace, name)
+        sorted_languages = get_repository_languages(git_client, namespace, name, cache)
 
         if not sorted_languages:
             return 'N/A'
 
         return select_language_by_priority(sorted_languages, namespace, name)
-    except GitLibException as gle:
-        if 'limit exhausted' in str(gle):
-            # Re-raise rate limit exceptions to be handled by the caller
-            raise
-        return 'N/A'
     except Exception as e:
         logger.error(f"Unexpected error querying repository {namespace}/{name}: {e}")
         return 'N/A'
 
 
-def update_language_for_row(prod_lang_df: pd.DataFrame, index: int, row: pd.Series, git_client: GitClient) -> bool:
+def get_repositories_to_query(prod_lang_df: pd.DataFrame) -> pd.Series:
     """
-    Update language information for a single row in the DataFrame.
+    Select the GitHub rows whose language is not known yet.
 
     Args:
         prod_lang_df: DataFrame with product-language mappings
-        index: Row index in the DataFrame
-        row: Row data as a Series
-        git_client: Initialized Git client
 
     Returns:
-        True if API rate limit was reached, False otherwise
+        Boolean mask over the rows of the DataFrame
     """
-    # Skip if language is already known
-    if not pd.isna(row['language']) and row['language'] != 'N/A':
-        return False
+    unknown_language = pd.isna(prod_lang_df['language']) | (prod_lang_df['language'] == 'N/A')
+
+    return unknown_language & (prod_lang_df['type'] == 'github')
+
+
+def query_github_repositories_language_rest(
+        git_client: GitHubClient, repositories: List[Tuple[str, str]], cache: Optional[RepositoryLanguagesCache] = None
+) -> Dict[Tuple[str, str], str]:
+    """
+    Query the language of GitHub repositories one by one through the REST API.
+
+    Args:
+        git_client: Initialized GitHub client
+        repositories: List of (namespace, name) tuples
+        cache: Cache of repository languages
+
+    Returns:
+        Dictionary mapping (namespace, name) tuples to the repository language or 'N/A'
+    """
+    return {(namespace, name): query_github_repository_language(git_client, namespace, name, cache)
+            for namespace, name in repositories}
+
+
+def query_github_repositories_language_batch(
+        git_client: GitHubClient, repositories: List[Tuple[str, str]], cache: Optional[RepositoryLanguagesCache] = None
+) -> Dict[Tuple[str, str], str]:
+    """
+    Query the language of a batch of GitHub repositories with a single GraphQL query.
+
+    Repositories that the GraphQL query could not resolve (other than non-existing ones) are queried one by one
+    through the REST API.
+
+    Args:
+        git_client: Initialized GitHub client
+        repositories: List of (namespace, name) tuples
+        cache: Cache where the results are stored
+
+    Returns:
+        Dictionary mapping (namespace, name) tuples to the repository language or 'N/A'
+    """
+    try:
+        batch_languages = git_client.get_languages_batch(repositories)
+    except GitHubClientError as gce:
+        logger.warning(f"Error querying {len(repositories)} GitHub repositories with GraphQL, Error: {gce}")
+        batch_languages = {}
+
+    languages = {}
+
+    for namespace, name in repositories:
+        if (namespace, name) not in batch_languages:
+            # REST fallback
+            languages[(namespace, name)] = query_github_repository_language(git_client, namespace, name, cache)
+            continue
+
+        languages_dict = batch_languages[(namespace, name)]
+        sorted_languages = sort_languages(languages_dict) if languages_dict is not None else None
+
+        if cache is not None:
+            cache.put(namespace, name, sorted_languages)
+
+        if languages_dict is None:
+            logger.warning(f"GitHub repository not found or not accessible: {namespace}/{name}")
+
+        if not sorted_languages:
+            languages[(namespace, name)] = 'N/A'
+        else:
+            languages[(namespace, name)] = select_language_by_priority(sorted_languages, namespace, name)
+
+    return languages
+
+
+def query_github_repositories_language(
+        git_client: GitHubClient, repositories: List[Tuple[str, str]], max_workers: int = GITHUB_MAX_WORKERS,
+        batch_size: Optional[int] = GITHUB_GRAPHQL_BATCH_SIZE, cache: Optional[RepositoryLanguagesCache] = None,
+        on_result: Optional[Callable[[Dict[Tuple[str, str], str]], None]] = None
+) -> Dict[Tuple[str, str], str]:
+    """
+    Query the language of many GitHub repositories concurrently.
+
+    The repositories are queried in batches of batch_size through the GraphQL API, with at most max_workers requests
+    in flight. When the API rate limit is exhausted, the GitHub client pauses all threads until the limit resets, so
+    the run does not stop early.
+
+    With a cache, repositories with a fresh entry are not queried, and stale entries with an ETag are revalidated with
+    conditional REST requests, which do not count against the rate limit when the languages did not change.
+
+    Args:
+        git_client: Initialized GitHub client
+        repositories: List of (namespace, name) tuples
+        max_workers: Maximum number of concurrent requests
+        batch_size: Number of repositories per GraphQL query; None queries each repository through the REST API
+        cache: Cache of repository languages
+        on_result: Function called, in the calling thread, with the languages of each batch once it is queried
+
+    Returns:
+        Dictionary mapping (namespace, name) tuples to the repository language or 'N/A'
+    """
+    languages = {}
+    to_revalidate = []
+
+    if cache is not None:
+        to_query = []
+
+        for namespace, name in repositories:
+            entry = cache.get(namespace, name)
+
+            if entry is None:
+                to_query.append((namespace, name))
+            elif cache.is_fresh(entry):
+                languages[(namespace, name)] = query_github_repository_language(git_client, namespace, name, cache)
+            elif entry.etag:
+                to_revalidate.append((namespace, name))
+            else:
+                to_query.append((namespace, name))
+
+        logger.info(f"Found {len(languages)} repositories in the cache, {len(to_revalidate)} to revalidate")
+        repositories = to_query
+
+        if on_result is not None and languages:
+            on_result(languages)
+
+    if batch_size is None:
+        query_batch, batch_size = query_github_repositories_language_rest, 1
+    else:
+        query_batch = query_github_repositories_language_batch
+
+    batches = [repositories[i:i + batch_size] for i in range(0, len(repositories), batch_size)]
+    # conditional requests are only available in the REST API
+    batches = [(query_github_repositories_language_rest, [repository]) for repository in to_revalidate] + \
+              [(query_batch, batch) for batch in batches]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            tqdm(total=len(repositories) + len(to_revalidate), desc="Querying GitHub repositories") as progress:
+        futures = {executor.submit(query, git_client, batch, cache): batch for query, batch in batches}
+
+        for future in as_completed(futures):
+            result = future.result()
+            languages.update(result)
+            progress.update(len(futures[future]))
+
+            if on_result is not None:
+                on_result(result)
+
+    return languages
 
-    # Only process GitHub repositories
-    if row['type'] == 'github':
-        try:
-            language = query_github_repository_language(git_client, row['namespace'], row['name'])
-            prod_lang_df.loc[index, 'language'] = language
-        except GitLibException:
-            # Rate limit reached
-            return True
 
-    return False
+def apply_journal_updates(prod_lang_df: pd.DataFrame, updates: List[Tuple[str, str, str]]) -> pd.Series:
+    """
+    Apply (vendor, product, language) updates to the DataFrame; later updates of a product take precedence.
+
+    Args:
+        prod_lang_df: DataFrame with product-language mappings
+        updates: List of (vendor, product, language) tuples
+
+    Returns:
+        Boolean mask of the rows updated
+    """
+    languages = {(vendor, product): language for vendor, product, language in updates}
+    keys = zip(prod_lang_df['vendor'], prod_lang_df['product'])
+    replayed = pd.Series([languages.get(key) for key in keys], index=prod_lang_df.index, dtype=object)
+    mask = replayed.notna()
+    prod_lang_df.loc[mask, 'language'] = replayed[mask]
+
+    return mask
 
 
 def get_products_language_from_repository(
-        prod_lang_df: pd.DataFrame, output_path: Path, git_client: GitClient
+        prod_lang_df: pd.DataFrame, output_path: Path, git_client: GitHubClient,
+        max_workers: int = GITHUB_MAX_WORKERS, batch_size: Optional[int] = GITHUB_GRAPHQL_BATCH_SIZE,
+        cache: Optional[RepositoryLanguagesCache] = None
 ) -> pd.DataFrame:
     """
     Update language information for products by querying GitHub repositories.
 
+    Each repository is queried once, even if several products point to it. The updates are checkpointed to an
+    append-only journal next to the output file while the repositories are queried. The journal of an interrupted run
+    is replayed first, so a restart resumes where it stopped, and it is removed once the output file is saved.
+
     Args:
         prod_lang_df: DataFrame with product-language mappings
         output_path: Path to save the updated CSV file
-        git_client: Initialized Git client
+        git_client: Initialized GitHub client
+        max_workers: Maximum number of concurrent GitHub API requests
+        batch_size: Number of repositories per GraphQL query; None queries each repository through the REST API
+        cache: Cache of repository languages
 
     Returns:
         Updated DataFrame with product-language mappings
     """
-    missing_language_count = len(prod_lang_df[pd.isna(prod_lang_df['language'])])
-    logger.info(f"Updating language information for {missing_language_count} products from GitHub repositories")
+    journal_path = output_path.with_suffix(".journal.jsonl")
+
+    with CheckpointJournal(journal_path, CHECKPOINT_EVERY, CHECKPOINT_INTERVAL) as journal:
+        replayed = apply_journal_updates(prod_lang_df, journal.replay())
+
+        if replayed.any():
+            logger.info(f"Resumed {replayed.sum()} language updates from {journal_path}")
+
+        missing_language_count = len(prod_lang_df[pd.isna(prod_lang_df['language'])])
+        logger.info(f"Updating language information for {missing_language_count} products from GitHub repositories")
+
+        # products already queried before the interruption are not queried again, even if their language is 'N/A'
+        to_query = get_repositories_to_query(prod_lang_df) & ~replayed
+        repo_keys = list(zip(prod_lang_df.loc[to_query, 'namespace'], prod_lang_df.loc[to_query, 'name']))
+        repo_products = {}
+
+        for vendor, product, repo_key in zip(prod_lang_df.loc[to_query, 'vendor'],
+                                             prod_lang_df.loc[to_query, 'product'], repo_keys):
+            repo_products.setdefault(repo_key, []).append((vendor, product))
 
-    for i, row in tqdm(prod_lang_df.iterrows(), total=len(prod_lang_df), desc="Querying GitHub repositories"):
-        rate_limit_reached = update_language_for_row(prod_lang_df, i, row, git_client)
-        if rate_limit_reached:
-            break
+        logger.info(f"Querying {len(repo_products)} unique GitHub repositories")
 
-    # Save updated DataFrame to CSV
-    save_and_log_results(prod_lang_df, output_path)
+        def checkpoint(languages: Dict[Tuple[str, str], str]):
+            journal.append(
+                (vendor, product, language) for repo_key, language in languages.items()
+                for vendor, product in repo_products[repo_key]
+            )
+
+        languages = query_github_repositories_language(
+            git_client, list(repo_products), max_workers, batch_size, cache, on_result=checkpoint
+        )
+        prod_lang_df.loc[to_query, 'language'] = [languages[repo_key] for repo_key in repo_keys]
+
+        # Save updated DataFrame to CSV
+        save_and_log_results(prod_lang_df, output_path)
+        journal.remove()
 
     return prod_lang_df
 
@@ -453,46 +839,44 @@ def load_existing_data(output_path: Path) -> pd.DataFrame:
     return pd.read_csv(output_path)
 
 
-def find_new_products(product_purl_df: pd.DataFrame, existing_pairs: Set[Tuple[str, str]]) -> List[dict]:
+def find_new_products(product_purl_df: pd.DataFrame, existing_df: pd.DataFrame) -> pd.DataFrame:
     """
     Find products in the database that are not in the existing data.
 
     Args:
         product_purl_df: DataFrame with all products from the database
-        existing_pairs: Set of existing (vendor, product) pairs
+        existing_df: DataFrame with existing product-language mappings
 
     Returns:
-        List of new product rows
+        DataFrame with the new product rows
     """
-    new_products = []
-    for _, row in tqdm(product_purl_df.iterrows(), desc="Finding new products", total=len(product_purl_df)):
-        if (row['vendor'], row['product']) not in existing_pairs:
-            new_products.append(row)
+    # anti-join on the (vendor, product) pairs
+    product_pairs = pd.MultiIndex.from_frame(product_purl_df[['vendor', 'product']])
+    existing_pairs = pd.MultiIndex.from_frame(existing_df[['vendor', 'product']])
+    new_products_df = product_purl_df[~product_pairs.isin(existing_pairs)]
 
-    if new_products:
-        logger.info(f"Found {len(new_products)} new products not in the existing data")
+    if not new_products_df.empty:
+        logger.info(f"Found {len(new_products_df)} new products not in the existing data")
     else:
         logger.info("No new products found in the database")
 
-    return new_products
+    return new_products_df
 
 
-def process_new_products(new_products: List[dict], existing_df: pd.DataFrame) -> pd.DataFrame:
+def process_new_products(new_products_df: pd.DataFrame, existing_df: pd.DataFrame) -> pd.DataFrame:
     """
     Process new products and merge them with existing data.
 
     Args:
-        new_products: List of new product rows
+        new_products_df: DataFrame with the new product rows
         existing_df: DataFrame with existing product-language mappings
 
     Returns:
         Updated DataFrame with product-language mappings
     """
-    if not new_products:
+    if new_products_df.empty:
         return existing_df
 
-    new_products_df = pd.DataFrame(new_products)
-
     # Process only the new products
     new_lang_df = map_pkg_to_language(new_products_df)
     logger.info(f"Processed {len(new_lang_df)} new products with language mappings")
@@ -521,17 +905,53 @@ def process_existing_data(output_path: Path, purl_db_path: Path, cpe_parser: Cpe
 
     # Load all products from the database
     logger.info(f"Loading products from database to find new entries...")
-    pairs = load_purl2cpe_pairs(purl_db_path)
-    product_purl_df = get_vendor_product_purl_df(pairs, cpe_parser)
-
-    # Create a set of existing vendor-product pairs for quick lookup
-    existing_pairs = set(zip(existing_df['vendor'], existing_df['product']))
+    pairs = iter_purl2cpe_pairs(purl_db_path)
+    product_purl_df = get_vendor_product_purl_df(pairs, cpe_parser, workers=cpu_count() or 1)
 
     # Find new products
-    new_products = find_new_products(product_purl_df, existing_pairs)
+    new_products_df = find_new_products(product_purl_df, existing_df)
 
     # Process new products and merge with existing data
-    return process_new_products(new_products, existing_df)
+    return process_new_products(new_products_df, existing_df)
+
+
+def get_purl2cpe_db_fingerprint(db_file: Path) -> dict:
+    """
+    Fingerprint the purl2cpe database by the SHA-1 hash of the file and the number of rows of the purl2cpe table.
+
+    Args:
+        db_file: Path to the SQLite database file
+
+    Returns:
+        Dictionary with the hash and the row count
+    """
+    sha1 = hashlib.sha1()
+
+    with Path(db_file).expanduser().open('rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            sha1.update(block)
+
+    conn = connect_purl2cpe_db(db_file)
+
+    try:
+        rows = conn.execute("SELECT COUNT(*) FROM purl2cpe").fetchone()[0]
+    finally:
+        conn.close()
+
+    return {'sha1': sha1.hexdigest(), 'rows': rows}
+
+
+def load_purl2cpe_db_fingerprint(fingerprint_path: Path) -> Optional[dict]:
+    if not fingerprint_path.exists():
+        return None
+
+    with fingerprint_path.open('r') as f:
+        return json.load(f)
+
+
+def save_purl2cpe_db_fingerprint(fingerprint_path: Path, fingerprint: dict) -> None:
+    with fingerprint_path.open('w') as f:
+        json.dump(fingerprint, f)
 
 
 def count_github_languages(github_repos: pd.DataFrame) -> pd.Series:
@@ -656,7 +1076,9 @@ def initialize_paths(purl_db_path: Optional[Path] = None, output_dir: Optional[P
     return purl_db_path, output_file_path
 
 
-def process_data(purl_db_path: Path, output_file_path: Path, cpe_parser: CpeParser, git_client: GitClient) -> pd.DataFrame:
+def process_data(purl_db_path: Path, output_file_path: Path, cpe_parser: CpeParser,
+                 git_client: GitHubClient, cache: Optional[RepositoryLanguagesCache] = None,
+                 skip_unchanged_db: bool = True) -> pd.DataFrame:
     """
     Process data to create or update product-language mappings.
 
@@ -664,13 +1086,21 @@ def process_data(purl_db_path: Path, output_file_path: Path, cpe_parser: CpePars
         purl_db_path: Path to the purl2cpe database
         output_file_path: Path to save the output CSV file
         cpe_parser: Initialized CPE parser
-        git_client: Initialized Git client
+        git_client: Initialized GitHub client
+        cache: Cache of repository languages
+        skip_unchanged_db: Skip looking for new products if the purl2cpe database has not changed since the last run
 
     Returns:
         DataFrame with product-language mappings
     """
+    fingerprint_path = output_file_path.with_suffix(".purl2cpe.json")
+    fingerprint = get_purl2cpe_db_fingerprint(purl_db_path)
+
     # Process data based on whether existing data exists
-    if output_file_path.exists():
+    if output_file_path.exists() and skip_unchanged_db and load_purl2cpe_db_fingerprint(fingerprint_path) == fingerprint:
+        logger.info("The purl2cpe database has not changed since the last run. Skipping new products...")
+        product_language_df = load_existing_data(output_file_path)
+    elif output_file_path.exists():
         product_language_df = process_existing_data(output_file_path, purl_db_path, cpe_parser)
     else:
         logger.info(f"No existing data found. Running full analysis...")
@@ -680,9 +1110,13 @@ def process_data(purl_db_path: Path, output_file_path: Path, cpe_parser: CpePars
     product_language_df = get_products_language_from_repository(
         product_language_df,
         output_file_path,
-        git_client
+        git_client,
+        cache=cache
     )
 
+    # Only once the output file is saved, so that new products are not skipped after an interrupted run
+    save_purl2cpe_db_fingerprint(fingerprint_path, fingerprint)
+
     return product_language_df
 
 
@@ -703,8 +1137,15 @@ def main(purl_db_path: Optional[Path] = None, output_dir: Optional[Path] = None)
     # Initialize clients
     cpe_parser, git_client = initialize_clients()
 
+    # Initialize the cache of repository languages
+    cache = RepositoryLanguagesCache(GITHUB_CACHE_PATH.expanduser(), GITHUB_CACHE_TTL, GITHUB_CACHE_NEGATIVE_TTL)
+    logger.info(f"Evicted {cache.evict(GITHUB_CACHE_MAX_AGE)} entries from the repository languages cache")
+
     # Process data
-    product_language_df = process_data(purl_db_path, output_file_path, cpe_parser, git_client)
+    try:
+        product_language_df = process_data(purl_db_path, output_file_path, cpe_parser, git_client, cache)
+    finally:
+        cache.close()
 
     # Count languages and log results
     count_and_log_languages(product_language_df)
@@ -1,15 +1,19 @@
+import re
 import json
+import numpy as np
 import pandas as pd
 
+from tqdm import tqdm
+from lxml import etree
 from typing import List
 from pathlib import Path
-from typing import Optional
-from pydantic import AnyUrl
-from collections import Counter
+from typing import Optional, Iterator, Tuple, Iterable
+from functools import lru_cache
+from urllib.parse import urlsplit
+from os import cpu_count
+from concurrent.futures import ProcessPoolExecutor
 
-from cpelib.types.item import CPEItem
-from cpelib.types.reference import Reference
-from cpelib.core.loaders.xml import XMLLoader
+from cpeparser import CpeParser
 
 
 root_path = Path(__file__).parent.parent
@@ -18,6 +22,14 @@ domain_sw_type_mapping_path = rq1_data_path / "domain_sw_type_mapping.json"
 keywords_sw_type_mapping_path = rq1_data_path / "keywords_sw_type_mapping.json"
 target_sw_type_mapping_path = rq1_data_path / "target_sw_type_mapping.json"
 output_file_path = rq1_data_path / "software_type.csv"
+conflicts_file_path = rq1_data_path / "software_type_conflicts.csv"
+cpe_dictionary_path = Path("~/.cpelib/official-cpe-dictionary_v2.3.xml")
+
+CPE_DICTIONARY_NS = "http://cpe.mitre.org/dictionary/2.0"
+CPE_23_NS = "http://scap.nist.gov/schema/cpe-extension/2.3"
+CPE_ITEM_TAG = f"{{{CPE_DICTIONARY_NS}}}cpe-item"
+CPE_23_ITEM_TAG = f"{{{CPE_23_NS}}}cpe23-item"
+REFERENCE_PATH = f"{{{CPE_DICTIONARY_NS}}}references/{{{CPE_DICTIONARY_NS}}}reference"
 
 
 # TODO: websites like [https://marketplace.eclipse.org/, mvnrepository.com, https://sourceforge.net/] could be used to
@@ -25,7 +37,64 @@ output_file_path = rq1_data_path / "software_type.csv"
 DOMAIN_SW_TYPE_MAPPING = json.load(open(domain_sw_type_mapping_path))
 KEYWORDS_MAPPING = json.load(open(keywords_sw_type_mapping_path))
 TGT_SW_MAPPING = json.load(open(target_sw_type_mapping_path))
-TGT_SW_ALL = [_tgt_sw_val for _, _tgt_sw_vals in TGT_SW_MAPPING.items() for _tgt_sw_val in _tgt_sw_vals]
+TGT_SW_ALL = frozenset(_tgt_sw_val for _, _tgt_sw_vals in TGT_SW_MAPPING.items() for _tgt_sw_val in _tgt_sw_vals)
+REFERENCE_HOST_CACHE_SIZE = 2 ** 16
+# scheme://[userinfo@]host[:port] followed by the path, query, fragment or the end of the URL
+REFERENCE_HOST_PATTERN = re.compile(
+    r"[A-Za-z][A-Za-z0-9+.-]*://(?:[^/?#\\\s]*@)?([^/?#\\\s@:\[\]]+)(?::[0-9]*)?(?=[/?#]|$)"
+)
+# schemes whose URLs have a host even when the slashes after the colon are missing or doubled, e.g., 'http:/host'
+SPECIAL_SCHEME_PATTERN = re.compile(r"^(https?|ftp|wss?):[/\\]*", re.IGNORECASE)
+PRODUCT_NAME_SEPARATORS = ['_', '-', ':', '.']
+
+
+def build_keyword_trie(keywords: Iterable[Tuple[str, int]]) -> dict:
+    """
+        Builds a character trie of nested dicts from (keyword, label index) pairs. The None key of a node holds the
+        lowest label index of the keywords ending at that node.
+    """
+    trie = {}
+
+    for keyword, index in keywords:
+        node = trie
+
+        for char in keyword:
+            node = node.setdefault(char, {})
+
+        node[None] = min(node.get(None, index), index)
+
+    return trie
+
+
+def match_keyword_trie(trie: dict, text: str) -> Optional[int]:
+    """
+        Returns the lowest label index of the keywords that are prefixes of the text, or None if there are none.
+    """
+    node = trie
+    best = node.get(None)
+
+    for char in text:
+        node = node.get(char)
+
+        if node is None:
+            break
+
+        if None in node and (best is None or node[None] < best):
+            best = node[None]
+
+    return best
+
+
+# precompiled from KEYWORDS_MAPPING; the label with the lowest index (first in the mapping) takes precedence
+KEYWORD_LABELS = list(KEYWORDS_MAPPING)
+KEYWORD_TOKEN_INDEX = {}
+
+for _index, _keywords in enumerate(KEYWORDS_MAPPING.values()):
+    for _keyword in _keywords:
+        KEYWORD_TOKEN_INDEX.setdefault(_keyword, _index)
+
+KEYWORD_PREFIX_TRIE = build_keyword_trie(KEYWORD_TOKEN_INDEX.items())
+KEYWORD_SUFFIX_TRIE = build_keyword_trie((_keyword[::-1], _index) for _keyword, _index in KEYWORD_TOKEN_INDEX.items())
 
 
 def label_target_software(product_name: str, tgt_sw: str) -> Optional[str]:
@@ -39,48 +108,146 @@ def label_target_software(product_name: str, tgt_sw: str) -> Optional[str]:
 
 
 def label_product_name(product_name: str) -> Optional[str]:
-    for sep in ['_', '-', ':', '.']:
-        terms = set(product_name.split(sep))
+    for sep in PRODUCT_NAME_SEPARATORS:
+        indexes = [KEYWORD_TOKEN_INDEX[term] for term in product_name.split(sep) if term in KEYWORD_TOKEN_INDEX]
 
-        for label, keywords in KEYWORDS_MAPPING.items():
-            if terms.intersection(keywords):
-                return label
+        if indexes:
+            return KEYWORD_LABELS[min(indexes)]
 
     # some product names have no separators, e.g., zlib, gnulib, libgcrypt, newsplugin, etc.
-    for label, keywords in KEYWORDS_MAPPING.items():
-        for keyword in keywords:
-            if product_name.startswith(keyword) or product_name.endswith(keyword):
-                return label
+    indexes = [
+        index for index in (match_keyword_trie(KEYWORD_PREFIX_TRIE, product_name),
+                            match_keyword_trie(KEYWORD_SUFFIX_TRIE, product_name[::-1]))
+        if index is not None
+    ]
 
-    return None
+    return KEYWORD_LABELS[min(indexes)] if indexes else None
+
+
+@lru_cache(maxsize=REFERENCE_HOST_CACHE_SIZE)
+def get_reference_host(reference: str) -> Optional[str]:
+    """
+        Returns the lowercased host of a reference URL, or None if it has none. Well-formed URLs are matched directly;
+        the others go through urlsplit, after the normalization done by the URL parser of pydantic's AnyUrl: surrounding
+        whitespace is ignored, backslashes are read as slashes and special schemes are followed by exactly two slashes.
+    """
+    match = REFERENCE_HOST_PATTERN.match(reference)
 
+    if match:
+        return match.group(1).lower()
+
+    reference = SPECIAL_SCHEME_PATTERN.sub(r"\1://", reference.strip().replace('\\', '/'))
+
+    try:
+        return urlsplit(reference).hostname
+    except ValueError:
+        # e.g., malformed IPv6 hosts
+        return None
+
+
+def get_reference_hosts(references: Tuple[str, ...]) -> Tuple[str, ...]:
+    """
+        Returns the hosts of the references that are in the domain mapping, in order and without repetitions. Only the
+        first of them can label the product, so the other references are dropped.
+    """
+    hosts = []
 
-def get_label_from_references(product_name: str, references: List[Reference]) -> Optional[str]:
     for reference in references:
-        obj_ref = AnyUrl(reference.href)
+        host = get_reference_host(reference)
+
+        if host in DOMAIN_SW_TYPE_MAPPING and host not in hosts:
+            hosts.append(host)
+
+    return tuple(hosts)
+
+
+def get_label_from_references(product_name: str, hosts: List[str]) -> Optional[str]:
+    if product_name in TGT_SW_ALL:
+        return None
 
-        if obj_ref.host in DOMAIN_SW_TYPE_MAPPING and product_name not in TGT_SW_ALL:
-            return DOMAIN_SW_TYPE_MAPPING[obj_ref.host] + "_ref"
+    for host in hosts:
+        if host in DOMAIN_SW_TYPE_MAPPING:
+            return DOMAIN_SW_TYPE_MAPPING[host] + "_ref"
 
     return None
 
 
-def label_cpe(cpe_item: CPEItem) -> str:
+def label_cpe(product: str, target_sw: str, hosts: Tuple[str, ...]) -> str:
     label = None
 
-    if cpe_item.references:
-        label = get_label_from_references(cpe_item.cpe.product, cpe_item.references)
+    if hosts:
+        label = get_label_from_references(product, hosts)
 
     if not label:
-        if cpe_item.cpe.target_sw and cpe_item.cpe.target_sw not in ['-', '*']:
-            label = label_target_software(cpe_item.cpe.product, cpe_item.cpe.target_sw)
+        if target_sw and target_sw not in ['-', '*']:
+            label = label_target_software(product, target_sw)
 
         if not label:
-            label = label_product_name(cpe_item.cpe.product)
+            label = label_product_name(product)
 
     return label
 
 
+def label_cpe_keys_chunk(keys: List[Tuple[str, str, Tuple[str, ...]]]) -> List[Optional[str]]:
+    return [label_cpe(product, target_sw, hosts) for product, target_sw, hosts in keys]
+
+
+def label_cpe_keys(keys: List[Tuple[str, str, Tuple[str, ...]]], workers: int = 1,
+                   chunk_size: int = 5000) -> List[Optional[str]]:
+    """
+        Labels the unique (product, target_sw, reference hosts) keys of the CPE items, in chunks across a process pool
+        when workers > 1. The labels are in the order of the keys.
+    """
+    chunks = [keys[i:i + chunk_size] for i in range(0, len(keys), chunk_size)]
+
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return [label for chunk in executor.map(label_cpe_keys_chunk, chunks) for label in chunk]
+
+    return [label for chunk in chunks for label in label_cpe_keys_chunk(chunk)]
+
+
+def parse_cpe_name(cpe_parser: CpeParser, name: str) -> Tuple[str, str, str]:
+    """
+        Returns the vendor, product and target_sw of a CPE 2.3 name, as CpeParser does, splitting well-formed names
+        directly.
+    """
+    name = name.strip().lower()
+
+    if name.startswith("cpe:2.3:") and ":~" not in name:
+        attributes = name[8:].split(":")
+
+        if len(attributes) >= 11:
+            # CpeParser replaces empty attributes with '*'
+            return attributes[1] or "*", attributes[2] or "*", attributes[8] or "*"
+
+    cpe = cpe_parser.parser(name)
+
+    return cpe['vendor'], cpe['product'], cpe['target_sw']
+
+
+def iter_cpe_dictionary(xml_file: Path) -> Iterator[Tuple[str, str, str, bool, Tuple[str, ...]]]:
+    """
+        Streams the cpe-item elements of the CPE dictionary, clearing each element once read, and yields only the
+        fields used for labeling: (vendor, product, target_sw, deprecated, reference hrefs). The CPE 2.3 name is
+        parsed as cpelib does.
+    """
+    cpe_parser = CpeParser()
+    context = etree.iterparse(str(xml_file.expanduser()), events=('end',), tag=CPE_ITEM_TAG)
+
+    for _, element in tqdm(context, desc="Processing CPE items", unit="item"):
+        vendor, product, target_sw = parse_cpe_name(cpe_parser, element.find(CPE_23_ITEM_TAG).get('name'))
+        references = tuple(reference.get('href') for reference in element.iterfind(REFERENCE_PATH))
+
+        yield vendor, product, target_sw, element.get('deprecated') == 'true', references
+
+        element.clear()
+
+        # free the processed siblings, which the parser keeps attached to the root
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
 def get_software_type_dataset_df() -> pd.DataFrame:
     # dataset from https://ksiresearch.org/seke/seke20paper/paper047.pdf
     # request access to the dataset from the authors https://github.com/onniegit/Software-Type-Dataset
@@ -104,48 +271,72 @@ def get_software_type_dataset_df() -> pd.DataFrame:
     return _df[_columns]
 
 
-def get_software_type_from_cpe_dict(output_file: Path) -> pd.DataFrame:
+def aggregate_software_types(cpe_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+        Picks one software type per (vendor, product) from the labels of its CPE items, in one pass over the label
+        counts of each product:
+            - a single label is kept;
+            - of two labels, the first one found from references (_ref) is kept, otherwise the product is ambiguous
+              and gets no software type;
+            - of more labels, the most frequent one is kept, ties going to the label found first.
+        Returns the software types sorted by vendor and product, and the label counts of the ambiguous products.
+    """
+    counts_df = (
+        cpe_df.assign(position=np.arange(len(cpe_df)))
+        .groupby(['vendor', 'product', 'software_type'], sort=False)['position']
+        .agg(count='size', first='min')
+        .reset_index()
+    )
+    products = counts_df.groupby(['vendor', 'product'], sort=False)
+    labels_count = products['software_type'].transform('size')
+    is_ref = counts_df['software_type'].str.contains('_ref', regex=False)
+    two_labels = labels_count == 2
+    ambiguous = two_labels & ~is_ref.groupby([counts_df['vendor'], counts_df['product']]).transform('any')
+
+    # tie rules as sort keys: _ref labels first for two labels, most frequent first otherwise, then first found
+    counts_df['rank'] = np.where(two_labels, (~is_ref).astype(int), -counts_df['count'])
+    counts_df['ambiguous'] = ambiguous
+    selected_df = counts_df.sort_values(['vendor', 'product', 'rank', 'first']).drop_duplicates(['vendor', 'product'])
+
+    sw_type_df = selected_df[['vendor', 'product', 'software_type']].reset_index(drop=True)
+    sw_type_df['software_type'] = sw_type_df['software_type'].where(~selected_df['ambiguous'].to_numpy(), None)
+    ambiguous_df = counts_df[ambiguous].sort_values(['vendor', 'product', 'first'])
+
+    return sw_type_df, ambiguous_df[['vendor', 'product', 'software_type', 'count']].reset_index(drop=True)
+
+
+def get_software_type_from_cpe_dict(output_file: Path, xml_file: Path = cpe_dictionary_path,
+                                    workers: int = 1) -> pd.DataFrame:
     # https://nvd.nist.gov/products/cpe
     # XML file should be placed under '~/.cpelib/official-cpe-dictionary_v2.3.xml' or provide the path to the file
-    loader = XMLLoader()
+    # the versions of a product mostly share the same key, so each key is labeled once and its label broadcast back
+    keys = {}
     cpe_rows = []
 
-    for cpe_item in loader():
-        if cpe_item.deprecated:
+    for vendor, product, target_sw, deprecated, references in iter_cpe_dictionary(xml_file):
+        if deprecated:
             continue
 
-        cpe_item_dict = cpe_item.cpe.model_dump()
-        cpe_item_dict['software_type'] = label_cpe(cpe_item)
-        cpe_rows.append(cpe_item_dict)
+        key = (product, target_sw, get_reference_hosts(references))
+        cpe_rows.append((vendor, product, keys.setdefault(key, len(keys))))
 
-    cpe_df = pd.DataFrame(cpe_rows)
-    cpe_df.dropna(inplace=True, subset=['software_type'])
+    print(f"Labeling {len(keys)} unique keys of {len(cpe_rows)} CPE items")
+    labels = label_cpe_keys(list(keys), workers=workers)
+    del keys
 
-    new_rows = []
-
-    for group, rows in cpe_df.groupby(["vendor", "product"]):
-        vendor, product = group
-        row = {"vendor": vendor, "product": product}
-
-        software_type_list = rows['software_type'].unique().tolist()
+    cpe_df = pd.DataFrame(cpe_rows, columns=['vendor', 'product', 'key'])
+    cpe_df['software_type'] = pd.Series(labels, dtype=object).take(cpe_df['key']).values
+    cpe_df.drop(columns=['key'], inplace=True)
+    cpe_df.dropna(inplace=True, subset=['software_type'])
 
-        if len(software_type_list) == 1:
-            row['software_type'] = software_type_list[0]
-        else:
-            if len(software_type_list) > 2:
-                row['software_type'] = Counter(rows['software_type'].tolist()).most_common(1)[0][0]
-            else:
-                for el in software_type_list:
-                    if "_ref" in el:
-                        row['software_type'] = el
-                        break
-                else:
-                    row['software_type'] = None
-                    print(f"Found multiple software types for {group}: {list(software_type_list)}")
+    _sw_type_df, ambiguous_df = aggregate_software_types(cpe_df)
 
-        new_rows.append(row)
+    if not ambiguous_df.empty:
+        ambiguous_file = output_file.with_name(f"{output_file.stem}_ambiguous.csv")
+        ambiguous_df.to_csv(ambiguous_file, index=False)
+        # ambiguous products have exactly two labels
+        print(f"Found multiple software types for {len(ambiguous_df) // 2} products, saved to {ambiguous_file}")
 
-    _sw_type_df = pd.DataFrame(new_rows)
     _sw_type_df.to_csv(output_file, index=False)
 
     print(_sw_type_df['software_type'].value_counts())
@@ -191,19 +382,56 @@ def select_software_type(x: str, y: str) -> str:
     raise ValueError(f"Unexpected combination of software types: {x} and {y}")
 
 
-if output_file_path.exists():
-    software_type_df = pd.read_csv(output_file_path)
-else:
-    cpe_software_type_df = get_software_type_from_cpe_dict(output_file_path)
-    software_type_dataset_df = get_software_type_dataset_df()
-
-    # check disagreement between labels
-    software_type_df = pd.merge(cpe_software_type_df, software_type_dataset_df, on=["vendor", "product"], how="outer")
-    software_type_df["software_type"] = software_type_df.apply(
-        lambda x: select_software_type(x['software_type_x'], x['software_type_y']), axis=1
-    )
-
-    software_type_df.drop(columns=["software_type_x", "software_type_y"], inplace=True)
-    software_type_df.to_csv(rq1_data_path / "software_type.csv", index=False)
-
-print(software_type_df['software_type'].value_counts())
+def select_software_types(software_type_df: pd.DataFrame, x_column: str = 'software_type_x',
+                          y_column: str = 'software_type_y') -> Tuple[pd.Series, pd.DataFrame]:
+    """
+        Applies select_software_type to all rows at once. The x and y columns are encoded as categorical codes (-1 for
+        missing values), select_software_type fills a decision table with one cell per pair of codes, and each row
+        looks up its cell. Rows with an unexpected pair get no software type and are returned as conflicts instead
+        of raising.
+    """
+    x = pd.Categorical(software_type_df[x_column])
+    y = pd.Categorical(software_type_df[y_column])
+    # row and column 0 of the table are for missing values
+    x_values = [np.nan] + x.categories.tolist()
+    y_values = [np.nan] + y.categories.tolist()
+    table = np.full((len(x_values), len(y_values)), np.nan, dtype=object)
+    unexpected = np.zeros(table.shape, dtype=bool)
+
+    for i, x_value in enumerate(x_values):
+        for j, y_value in enumerate(y_values):
+            try:
+                table[i, j] = select_software_type(x_value, y_value)
+            except ValueError:
+                unexpected[i, j] = True
+
+    rows, columns = x.codes + 1, y.codes + 1
+    software_types = pd.Series(table[rows, columns], index=software_type_df.index, dtype=object)
+    conflicts_df = software_type_df[unexpected[rows, columns]]
+
+    return software_types, conflicts_df
+
+
+if __name__ == "__main__":
+    if output_file_path.exists():
+        software_type_df = pd.read_csv(output_file_path)
+    else:
+        cpe_software_type_df = get_software_type_from_cpe_dict(output_file_path, workers=cpu_count() or 1)
+        software_type_dataset_df = get_software_type_dataset_df()
+
+        # check disagreement between labels
+        software_type_df = pd.merge(
+            cpe_software_type_df, software_type_dataset_df, on=["vendor", "product"], how="outer"
+        )
+        software_type_df["software_type"], conflicts_df = select_software_types(software_type_df)
+
+        if not conflicts_df.empty:
+            conflicts_df.to_csv(conflicts_file_path, index=False)
+            print(
+                f"Found {len(conflicts_df)} unexpected combinations of software types, saved to {conflicts_file_path}"
+            )
+
+        software_type_df.drop(columns=["software_type_x", "software_type_y"], inplace=True)
+        software_type_df.to_csv(rq1_data_path / "software_type.csv", index=False)
+
+    print(software_type_df['software_type'].value_counts())
@@ -0,0 +1,326 @@
+import time
+import random
+import logging
+import threading
+import requests
+
+from typing import Optional, Dict, List, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+GITHUB_API_URL = "https://api.github.com"
+
+# Statuses worth retrying: GitHub answers 502/503/504 when a request times out on its side
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+
+# Number of languages requested per repository in GraphQL queries, by size (descending)
+GRAPHQL_LANGUAGES_COUNT = 10
+
+GRAPHQL_REPOSITORY_FIELDS = (
+    "languages(first: %d, orderBy: {field: SIZE, direction: DESC}) { edges { size node { name } } }"
+    % GRAPHQL_LANGUAGES_COUNT
+)
+
+
+class GitHubClientError(Exception):
+    pass
+
+
+class GitHubClient:
+    """
+    Thread-safe client for the GitHub REST and GraphQL APIs that pauses when the rate limit is exhausted and retries transient
+    failures with exponential backoff.
+
+    The rate limit is read from the X-RateLimit-Remaining and X-RateLimit-Reset headers of every response. Once the
+    remaining requests run out, or GitHub answers with a (secondary) rate limit error, all threads wait until the
+    reset time and then resume.
+    """
+
+    def __init__(self, token: Optional[str], api_url: str = GITHUB_API_URL, max_retries: int = 5,
+                 backoff_factor: float = 1.0, timeout: float = 30.0):
+        """
+        Args:
+            token: GitHub API token; None sends unauthenticated requests
+            api_url: Base URL of the GitHub API
+            max_retries: Number of retries of a request after a transient failure
+            backoff_factor: Base delay, in seconds, of the exponential backoff between retries
+            timeout: Timeout, in seconds, of each request
+        """
+        self.api_url = api_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.headers = {"Accept": "application/vnd.github+json"}
+
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+
+        self.rate_limit_remaining = None
+        self.rate_limit_reset = None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        # requests.Session is not guaranteed to be thread-safe, so each thread gets its own
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+            self._local.session.headers.update(self.headers)
+
+        return self._local.session
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Send a request to the GitHub API, waiting for the rate limit to reset and retrying transient failures.
+
+        Args:
+            method: HTTP method
+            path: Path relative to the API URL (e.g., "/repos/owner/name/languages")
+            **kwargs: Further arguments for requests.Session.request
+
+        Returns:
+            The response, which may have a client error status (e.g., 404)
+
+        Raises:
+            GitHubClientError: If the request still fails after all retries
+        """
+        url = f"{self.api_url}{path}"
+        attempt = 0
+
+        while True:
+            self.wait_for_rate_limit()
+
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                self.update_rate_limit(response)
+
+                if self.is_rate_limited(response):
+                    # does not count as a retry, the request is sent again once the limit resets
+                    self.pause(response)
+                    continue
+
+                if response.status_code not in TRANSIENT_STATUS_CODES:
+                    return response
+
+                error = f"HTTP {response.status_code}"
+
+            if attempt >= self.max_retries:
+                raise GitHubClientError(f"{method} {url} failed after {attempt + 1} attempts: {error}")
+
+            delay = self.backoff_factor * 2 ** attempt * (1 + random.random())
+            logger.debug(f"{method} {url} failed ({error}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    def update_rate_limit(self, response: requests.Response):
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+
+        if remaining is None or reset is None:
+            return
+
+        with self._lock:
+            self.rate_limit_remaining = int(remaining)
+            self.rate_limit_reset = float(reset)
+
+            if self.rate_limit_remaining == 0:
+                self._pause_until(self.rate_limit_reset)
+
+    @staticmethod
+    def is_rate_limited(response: requests.Response) -> bool:
+        if response.status_code == 429:
+            return True
+
+        if response.status_code != 403:
+            return False
+
+        if response.headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in response.headers:
+            return True
+
+        # secondary rate limits are not always sent with headers, only with a message
+        return "rate limit" in response.text.lower()
+
+    def pause(self, response: requests.Response):
+        """
+        Pause all requests after a rate limit error, until the time given by Retry-After or X-RateLimit-Reset.
+        """
+        retry_after = response.headers.get("Retry-After")
+
+        if retry_after is not None:
+            resume_at = time.time() + float(retry_after)
+        elif response.headers.get("X-RateLimit-Reset") is not None:
+            resume_at = float(response.headers["X-RateLimit-Reset"])
+        else:
+            # secondary rate limits without headers: GitHub recommends waiting at least a minute
+            resume_at = time.time() + 60
+
+        with self._lock:
+            self._pause_until(resume_at)
+
+    def _pause_until(self, resume_at: float):
+        # called with the lock held; one second of margin for clock differences with GitHub
+        resume_at += 1
+
+        if resume_at > self._paused_until:
+            self._paused_until = resume_at
+            logger.warning(f"GitHub API rate limit reached. Pausing for {max(resume_at - time.time(), 0):.0f}s")
+
+    def wait_for_rate_limit(self):
+        while True:
+            with self._lock:
+                delay = self._paused_until - time.time()
+
+            if delay <= 0:
+                return
+
+            time.sleep(min(delay, 60))
+
+    def get_languages(self, namespace: str, name: str) -> Optional[Dict[str, int]]:
+        """
+        Get the languages of a repository.
+
+        Args:
+            namespace: Repository owner/namespace
+            name: Repository name
+
+        Returns:
+            Dictionary mapping languages to byte counts (empty if the repository has none), or None if the repository
+            does not exist (404) or is blocked for legal reasons (451)
+
+        Raises:
+            GitHubClientError: If the request fails after all retries or with an unexpected status
+        """
+        return self.get_languages_if_modified(namespace, name)[1]
+
+    def get_languages_if_modified(
+            self, namespace: str, name: str, etag: Optional[str] = None
+    ) -> Tuple[bool, Optional[Dict[str, int]], Optional[str]]:
+        """
+        Get the languages of a repository, with a conditional request if the ETag of a previous response is given.
+        Unmodified responses (304) do not count against the rate limit.
+
+        Args:
+            namespace: Repository owner/namespace
+            name: Repository name
+            etag: ETag of a previous response for the repository
+
+        Returns:
+            Tuple of (modified, languages, etag). If not modified, languages is None and the previous response still
+            holds. Otherwise, languages is as returned by get_languages, and etag is the ETag of the response.
+
+        Raises:
+            GitHubClientError: If the request fails after all retries or with an unexpected status
+        """
+        headers = {"If-None-Match": etag} if etag else None
+        response = self.request("GET", f"/repos/{namespace}/{name}/languages", headers=headers)
+
+        if response.status_code == 304:
+            return False, None, etag
+
+        if response.status_code in (404, 451):
+            # not found, or blocked for legal reasons
+            return True, None, None
+
+        # other errors, including 403s that are not rate limits (e.g., a bad token or SSO enforcement), are raised so
+        # that the repository is not taken, and cached, as not found
+
+        if response.status_code != 200:
+            raise GitHubClientError(f"Unexpected status {response.status_code} for {namespace}/{name}")
+
+        return True, response.json(), response.headers.get("ETag")
+
+    def graphql(self, query: str, variables: dict) -> dict:
+        """
+        Send a query to the GitHub GraphQL API, waiting for the rate limit to reset if the query is rate limited.
+
+        Args:
+            query: GraphQL query
+            variables: Values of the query variables
+
+        Returns:
+            The response body, with "data" and possibly "errors"
+
+        Raises:
+            GitHubClientError: If the request fails after all retries or the response has no data
+        """
+        while True:
+            response = self.request("POST", "/graphql", json={"query": query, "variables": variables})
+
+            if response.status_code != 200:
+                raise GitHubClientError(f"GraphQL request failed with status {response.status_code}")
+
+            body = response.json()
+            errors = body.get("errors") or []
+
+            # the GraphQL rate limit is reported in the body, with status 200
+            if any(error.get("type") == "RATE_LIMITED" for error in errors):
+                self.pause(response)
+                continue
+
+            if body.get("data") is None:
+                raise GitHubClientError(f"GraphQL request failed: {errors}")
+
+            return body
+
+    def get_languages_batch(
+            self, repositories: List[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Optional[Dict[str, int]]]:
+        """
+        Get the languages of many repositories with one GraphQL query, with an aliased field per repository.
+
+        Args:
+            repositories: List of (namespace, name) tuples
+
+        Returns:
+            Dictionary mapping (namespace, name) tuples to dictionaries of languages and byte counts, or to None if the
+            repository does not exist. Repositories whose field failed for another reason are left out, so the caller
+            can query them again, e.g., through get_languages.
+
+        Raises:
+            GitHubClientError: If the whole query fails
+        """
+        if not repositories:
+            return {}
+
+        parameters = []
+        fields = []
+        variables = {}
+
+        for i, (namespace, name) in enumerate(repositories):
+            parameters.append(f"$o{i}: String!, $n{i}: String!")
+            fields.append(f"r{i}: repository(owner: $o{i}, name: $n{i}) {{ {GRAPHQL_REPOSITORY_FIELDS} }}")
+            variables[f"o{i}"] = namespace
+            variables[f"n{i}"] = name
+
+        query = f"query({', '.join(parameters)}) {{ {' '.join(fields)} }}"
+        body = self.graphql(query, variables)
+        failed = set()
+
+        for error in body.get("errors") or []:
+            path = error.get("path") or []
+
+            if path and error.get("type") != "NOT_FOUND":
+                failed.add(path[0])
+
+        languages = {}
+
+        for i, repository in enumerate(repositories):
+            alias = f"r{i}"
+
+            if alias in failed or alias not in body["data"]:
+                continue
+
+            repository_data = body["data"][alias]
+
+            if repository_data is None:
+                languages[repository] = None
+            else:
+                edges = repository_data["languages"]["edges"]
+                languages[repository] = {edge["node"]["name"]: edge["size"] for edge in edges}
+
+        return languages
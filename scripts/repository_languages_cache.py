@@ -0,0 +1,121 @@
+import json
+import time
+import sqlite3
+import threading
+
+from pathlib import Path
+from typing import Optional, List, Tuple, NamedTuple
+
+
+STATUS_OK = "ok"
+STATUS_NOT_FOUND = "not_found"
+
+
+class CacheEntry(NamedTuple):
+    # (language, byte_count) tuples sorted by byte count (descending); None if the repository does not exist
+    languages: Optional[List[Tuple[str, int]]]
+    status: str
+    fetched_at: float
+    etag: Optional[str]
+
+
+class RepositoryLanguagesCache:
+    """
+    Persisted cache of the languages of GitHub repositories, stored in an SQLite file and shared between threads.
+
+    Both positive and negative results are cached: repositories without languages are stored with an empty list, and
+    repositories that do not exist (or are blocked) with the not_found status. Entries are fresh for ttl
+    seconds (negative_ttl for not_found entries); stale entries keep their ETag so they can be revalidated with a
+    conditional request.
+    """
+
+    def __init__(self, cache_path: Path, ttl: float, negative_ttl: float):
+        """
+        Args:
+            cache_path: Path to the SQLite file
+            ttl: Number of seconds an entry stays fresh
+            negative_ttl: Number of seconds a not_found entry stays fresh
+        """
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self.conn.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS repositories (
+                repository TEXT PRIMARY KEY, languages TEXT, status TEXT NOT NULL, fetched_at REAL NOT NULL, etag TEXT
+            );
+            """
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM repositories").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, namespace: str, name: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT languages, status, fetched_at, etag FROM repositories WHERE repository = ?",
+                (f"{namespace}/{name}",)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        languages, status, fetched_at, etag = row
+
+        if languages is not None:
+            languages = [tuple(language) for language in json.loads(languages)]
+
+        return CacheEntry(languages, status, fetched_at, etag)
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        ttl = self.negative_ttl if entry.status == STATUS_NOT_FOUND else self.ttl
+
+        return time.time() - entry.fetched_at < ttl
+
+    def put(self, namespace: str, name: str, languages: Optional[List[Tuple[str, int]]], etag: Optional[str] = None):
+        """
+        Store the sorted languages of a repository, or None if it does not exist.
+        """
+        status = STATUS_NOT_FOUND if languages is None else STATUS_OK
+        languages = None if languages is None else json.dumps(languages)
+
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO repositories (repository, languages, status, fetched_at, etag) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (f"{namespace}/{name}", languages, status, time.time(), etag)
+            )
+            self.conn.commit()
+
+    def touch(self, namespace: str, name: str):
+        """
+        Mark the entry of a repository as fresh, e.g., after a conditional request found it not modified.
+        """
+        with self._lock:
+            self.conn.execute(
+                "UPDATE repositories SET fetched_at = ? WHERE repository = ?", (time.time(), f"{namespace}/{name}")
+            )
+            self.conn.commit()
+
+    def evict(self, max_age: float) -> int:
+        """
+        Remove the entries fetched more than max_age seconds ago.
+
+        Returns:
+            The number of entries removed.
+        """
+        with self._lock:
+            cursor = self.conn.execute("DELETE FROM repositories WHERE fetched_at < ?", (time.time() - max_age,))
+            self.conn.commit()
+
+        return cursor.rowcount
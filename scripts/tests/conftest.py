@@ -0,0 +1,18 @@
+import sys
+import pytest
+
+from pathlib import Path
+
+# the scripts are not a package; make them and the stub server importable
+sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from github_stub_server import GitHubStubServer
+
+
+@pytest.fixture
+def github_stub():
+    server = GitHubStubServer()
+    server.start()
+    yield server
+    server.stop()
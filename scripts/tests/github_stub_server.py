@@ -0,0 +1,230 @@
+import json
+import math
+import time
+import threading
+
+from typing import Optional, Dict, List, Tuple
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class GitHubStubServer:
+    """
+    Local stand-in for the GitHub REST and GraphQL APIs, served with http.server on a free port of 127.0.0.1.
+
+    It answers GET /repos/{namespace}/{name}/languages and POST /graphql (the aliased repository queries sent by
+    GitHubClient.get_languages_batch) from the repositories dictionary, where None marks a repository that does not
+    exist. It also simulates the behaviors the client has to cope with:
+
+    - a primary rate limit of rate_limit requests per rate_limit_window seconds, reported in the X-RateLimit-* headers
+      and answered with 403 once exhausted;
+    - scripted responses, returned by the next requests to a path before the regular answer (e.g., a 502 or a 429);
+    - GraphQL aliases that fail with an error other than NOT_FOUND;
+    - a delay per request, to observe how many requests are in flight at once.
+
+    Every request is recorded as a (method, path, status, time) tuple.
+    """
+
+    def __init__(self, repositories: Dict[str, Optional[Dict[str, int]]] = None, rate_limit: Optional[int] = None,
+                 rate_limit_window: float = 1.0, delay: float = 0.0):
+        """
+        Args:
+            repositories: Dictionary mapping 'namespace/name' to languages and byte counts, or None if not found
+            rate_limit: Number of requests allowed per window; None disables the rate limit
+            rate_limit_window: Length, in seconds, of a rate limit window
+            delay: Number of seconds each request takes
+        """
+        self.repositories = repositories or {}
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.delay = delay
+        self.graphql_errors: Dict[str, str] = {}
+        self.requests: List[Tuple[str, str, int, float]] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._scripted: Dict[str, List[Tuple[int, Dict[str, str], dict]]] = {}
+        self._remaining = rate_limit
+        self._reset_at = None
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def script(self, path: str, *responses: Tuple[int, Dict[str, str], dict]):
+        """
+        Queue (status, headers, body) responses for the next requests to the path.
+        """
+        with self._lock:
+            self._scripted.setdefault(path, []).extend(responses)
+
+    def fail_graphql(self, repository: str, error_type: str = "FORBIDDEN"):
+        """
+        Make the alias of the repository ('namespace/name') fail with the given error type in GraphQL queries.
+        """
+        self.graphql_errors[repository] = error_type
+
+    def get_requests(self, method: str = None, path: str = None) -> List[Tuple[str, str, int, float]]:
+        with self._lock:
+            return [
+                request for request in self.requests
+                if (method is None or request[0] == method) and (path is None or request[1] == path)
+            ]
+
+    def _rate_limit_headers(self) -> Tuple[bool, Dict[str, str]]:
+        # called with the lock held; returns whether the request is allowed, and the headers to send
+        if self.rate_limit is None:
+            return True, {}
+
+        now = time.time()
+
+        if self._reset_at is None or now >= self._reset_at:
+            # GitHub sends the reset time in whole epoch seconds
+            self._reset_at = math.ceil(now + self.rate_limit_window)
+            self._remaining = self.rate_limit
+
+        allowed = self._remaining > 0
+
+        if allowed:
+            self._remaining -= 1
+
+        return allowed, {
+            "X-RateLimit-Limit": str(self.rate_limit),
+            "X-RateLimit-Remaining": str(self._remaining),
+            "X-RateLimit-Reset": str(self._reset_at),
+        }
+
+    def _languages_response(self, path: str) -> Tuple[int, dict]:
+        parts = path.strip("/").split("/")
+
+        if len(parts) != 4 or parts[0] != "repos" or parts[3] != "languages":
+            return 404, {"message": "Not Found"}
+
+        languages = self.repositories.get(f"{parts[1]}/{parts[2]}")
+
+        if languages is None:
+            return 404, {"message": "Not Found"}
+
+        return 200, languages
+
+    def _graphql_response(self, request: dict) -> Tuple[int, dict]:
+        variables = request.get("variables") or {}
+        data = {}
+        errors = []
+        i = 0
+
+        while f"o{i}" in variables:
+            alias = f"r{i}"
+            repository = f"{variables[f'o{i}']}/{variables[f'n{i}']}"
+            i += 1
+
+            if repository in self.graphql_errors:
+                data[alias] = None
+                errors.append({"type": self.graphql_errors[repository], "path": [alias], "message": "Failed"})
+                continue
+
+            languages = self.repositories.get(repository)
+
+            if languages is None:
+                data[alias] = None
+                errors.append({
+                    "type": "NOT_FOUND", "path": [alias],
+                    "message": f"Could not resolve to a Repository with the name '{repository}'."
+                })
+                continue
+
+            edges = [
+                {"size": size, "node": {"name": language}}
+                for language, size in sorted(languages.items(), key=lambda x: x[1], reverse=True)
+            ]
+            data[alias] = {"languages": {"edges": edges[:10]}}
+
+        body = {"data": data}
+
+        if errors:
+            body["errors"] = errors
+
+        return 200, body
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str):
+        path = handler.path
+        length = int(handler.headers.get("Content-Length") or 0)
+        request = json.loads(handler.rfile.read(length)) if length else None
+
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+
+            with self._lock:
+                allowed, headers = self._rate_limit_headers()
+                scripted = self._scripted.get(path)
+
+                if not allowed:
+                    status, body = 403, {"message": "API rate limit exceeded"}
+                elif scripted:
+                    status, scripted_headers, body = scripted.pop(0)
+                    headers.update(scripted_headers)
+                elif method == "POST" and path == "/graphql":
+                    status, body = self._graphql_response(request)
+                else:
+                    status, body = self._languages_response(path)
+
+                self.requests.append((method, path, status, time.time()))
+
+            payload = json.dumps(body).encode()
+            handler.send_response(status)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(payload)))
+
+            for header, value in headers.items():
+                handler.send_header(header, value)
+
+            handler.end_headers()
+            handler.wfile.write(payload)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub._handle(self, "GET")
+
+            def do_POST(self):
+                stub._handle(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    # manual runs: point GitHubClient(token, api_url=...) at the printed URL
+    server = GitHubStubServer({"octocat/hello-world": {"C": 1000, "Shell": 100}}, rate_limit=60, rate_limit_window=60)
+    server.start()
+    print(f"GitHub stub API listening on {server.url}")
+
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
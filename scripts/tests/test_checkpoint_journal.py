@@ -0,0 +1,32 @@
+from checkpoint_journal import CheckpointJournal
+
+
+UPDATES = [("acme", "site", "PHP"), ("acme", "tool", "Go")]
+
+
+def test_replay_returns_flushed_updates(tmp_path):
+    journal_path = tmp_path / "journal.jsonl"
+
+    with CheckpointJournal(journal_path, flush_every=1) as journal:
+        journal.append(UPDATES)
+
+    with CheckpointJournal(journal_path) as journal:
+        assert journal.replay() == UPDATES
+
+
+def test_torn_tail_is_truncated_before_appending(tmp_path):
+    journal_path = tmp_path / "journal.jsonl"
+
+    with CheckpointJournal(journal_path, flush_every=1) as journal:
+        journal.append(UPDATES)
+
+    # a crash in the middle of a write
+    with journal_path.open('a') as f:
+        f.write('["acme", "do')
+
+    with CheckpointJournal(journal_path, flush_every=1) as journal:
+        assert journal.replay() == UPDATES
+        journal.append([("acme", "docs", "N/A")])
+
+    with CheckpointJournal(journal_path) as journal:
+        assert journal.replay() == UPDATES + [("acme", "docs", "N/A")]
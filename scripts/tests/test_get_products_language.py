@@ -0,0 +1,74 @@
+from github_client import GitHubClient
+from repository_languages_cache import RepositoryLanguagesCache, STATUS_OK, STATUS_NOT_FOUND
+from get_products_language import (
+    sort_languages, select_language_by_priority, query_github_repositories_language_batch,
+    query_github_repositories_language
+)
+
+
+REPOSITORIES = {
+    # main language not a primary language, so the second one is selected
+    "acme/site": {"HTML": 5000, "PHP": 3000},
+    "acme/tool": {"Go": 800, "Shell": 100},
+    "acme/docs": {},
+    "acme/gone": None,
+    # answered with an error other than NOT_FOUND in GraphQL queries, and from REST
+    "acme/flaky": {"Shell": 300, "Rust": 200},
+}
+
+
+def expected_language(repository: str) -> str:
+    languages = REPOSITORIES[repository]
+
+    if not languages:
+        return 'N/A'
+
+    namespace, name = repository.split("/")
+
+    return select_language_by_priority(sort_languages(languages), namespace, name)
+
+
+def test_batch_resolves_aliases_and_falls_back_to_rest_for_failed_ones(github_stub, tmp_path):
+    github_stub.repositories = REPOSITORIES
+    github_stub.fail_graphql("acme/flaky")
+    client = GitHubClient("token", api_url=github_stub.url, max_retries=0)
+    cache = RepositoryLanguagesCache(tmp_path / "cache.sqlite", ttl=3600, negative_ttl=3600)
+    repositories = [tuple(repository.split("/")) for repository in REPOSITORIES]
+
+    languages = query_github_repositories_language_batch(client, repositories, cache)
+
+    assert languages == {tuple(repository.split("/")): expected_language(repository) for repository in REPOSITORIES}
+    assert languages[("acme", "site")] == "PHP"
+    assert languages[("acme", "flaky")] == "Rust"
+    # one aliased query for the whole batch, and REST only for the alias that failed
+    assert len(github_stub.get_requests("POST", "/graphql")) == 1
+    assert [request[1] for request in github_stub.get_requests("GET")] == ["/repos/acme/flaky/languages"]
+
+    assert cache.get("acme", "gone").status == STATUS_NOT_FOUND
+    assert cache.get("acme", "docs").languages == []
+    assert cache.get("acme", "flaky").status == STATUS_OK
+    cache.close()
+
+
+def test_failed_query_falls_back_to_rest_for_the_whole_batch(github_stub):
+    github_stub.repositories = REPOSITORIES
+    github_stub.script("/graphql", (502, {}, {"message": "Server Error"}))
+    client = GitHubClient("token", api_url=github_stub.url, max_retries=0)
+    repositories = [tuple(repository.split("/")) for repository in REPOSITORIES]
+
+    languages = query_github_repositories_language_batch(client, repositories)
+
+    assert languages == {tuple(repository.split("/")): expected_language(repository) for repository in REPOSITORIES}
+    assert len(github_stub.get_requests("GET")) == len(REPOSITORIES)
+
+
+def test_repositories_are_split_into_batches(github_stub):
+    github_stub.repositories = {f"owner/repo{i}": {"Python": 100} for i in range(25)}
+    client = GitHubClient("token", api_url=github_stub.url)
+    repositories = [("owner", f"repo{i}") for i in range(25)]
+
+    languages = query_github_repositories_language(client, repositories, max_workers=2, batch_size=10)
+
+    assert languages == {repository: "Python" for repository in repositories}
+    assert len(github_stub.get_requests("POST", "/graphql")) == 3
+    assert not github_stub.get_requests("GET")
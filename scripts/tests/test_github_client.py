@@ -0,0 +1,125 @@
+import time
+import pytest
+
+from github_client import GitHubClient, GitHubClientError
+from repository_languages_cache import RepositoryLanguagesCache, STATUS_NOT_FOUND
+from get_products_language import get_repository_languages, query_github_repositories_language
+
+
+LANGUAGES_PATH = "/repos/{}/languages"
+
+
+def make_repositories(count: int) -> dict:
+    return {f"owner/repo{i}": {"Python": 1000 + i, "Shell": 10} for i in range(count)}
+
+
+def test_get_languages(github_stub):
+    github_stub.repositories = {"octocat/hello": {"C": 100, "Python": 2000}, "octocat/gone": None}
+    client = GitHubClient("token", api_url=github_stub.url)
+
+    assert client.get_languages("octocat", "hello") == {"C": 100, "Python": 2000}
+    assert client.get_languages("octocat", "gone") is None
+
+
+def test_exhausted_rate_limit_pauses_and_resumes(github_stub):
+    github_stub.repositories = make_repositories(10)
+    github_stub.rate_limit = 4
+    client = GitHubClient("token", api_url=github_stub.url, max_retries=0)
+    repositories = [("owner", f"repo{i}") for i in range(10)]
+
+    start = time.time()
+    languages = query_github_repositories_language(client, repositories, max_workers=4, batch_size=None)
+
+    assert languages == {repository: "Python" for repository in repositories}
+    # 10 requests at 4 per window need at least two resets
+    assert time.time() - start >= 2 * github_stub.rate_limit_window
+    served = [request for request in github_stub.get_requests() if request[2] == 200]
+    assert len(served) == 10
+
+    # no more than rate_limit requests were served in any window
+    for _, _, _, served_at in served:
+        window = [request for request in served if served_at <= request[3] < served_at + 1]
+        assert len(window) <= github_stub.rate_limit
+
+
+def test_rate_limited_response_is_sent_again_after_reset(github_stub):
+    github_stub.repositories = make_repositories(1)
+    path = LANGUAGES_PATH.format("owner/repo0")
+    reset = str(int(time.time()) + 1)
+    github_stub.script(path, (403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": reset}, {"message": "limit"}))
+    client = GitHubClient("token", api_url=github_stub.url, max_retries=0)
+
+    assert client.get_languages("owner", "repo0") == {"Python": 1000, "Shell": 10}
+    (_, _, first_status, first_at), (_, _, second_status, second_at) = github_stub.get_requests(path=path)
+    assert (first_status, second_status) == (403, 200)
+    assert second_at >= float(reset)
+
+
+@pytest.mark.parametrize("status, headers, body", [
+    (429, {"Retry-After": "1"}, {"message": "Too many requests"}),
+    (403, {"Retry-After": "1"}, {"message": "You have exceeded a secondary rate limit"}),
+])
+def test_secondary_rate_limit_waits_for_retry_after(github_stub, status, headers, body):
+    github_stub.repositories = make_repositories(1)
+    path = LANGUAGES_PATH.format("owner/repo0")
+    github_stub.script(path, (status, headers, body))
+    client = GitHubClient("token", api_url=github_stub.url, max_retries=0)
+
+    start = time.time()
+    assert client.get_languages("owner", "repo0") == {"Python": 1000, "Shell": 10}
+    assert time.time() - start >= 1
+    assert [request[2] for request in github_stub.get_requests(path=path)] == [status, 200]
+
+
+def test_transient_error_is_retried(github_stub):
+    github_stub.repositories = make_repositories(1)
+    path = LANGUAGES_PATH.format("owner/repo0")
+    github_stub.script(path, (502, {}, {"message": "Server Error"}), (503, {}, {"message": "Unavailable"}))
+    client = GitHubClient("token", api_url=github_stub.url, max_retries=2, backoff_factor=0.01)
+
+    assert client.get_languages("owner", "repo0") == {"Python": 1000, "Shell": 10}
+    assert [request[2] for request in github_stub.get_requests(path=path)] == [502, 503, 200]
+
+
+def test_transient_error_fails_after_retries(github_stub):
+    github_stub.repositories = make_repositories(1)
+    path = LANGUAGES_PATH.format("owner/repo0")
+    github_stub.script(path, *[(502, {}, {"message": "Server Error"})] * 3)
+    client = GitHubClient("token", api_url=github_stub.url, max_retries=1, backoff_factor=0.01)
+
+    with pytest.raises(GitHubClientError):
+        client.get_languages("owner", "repo0")
+
+    assert len(github_stub.get_requests(path=path)) == 2
+
+
+def test_requests_in_flight_are_bounded(github_stub):
+    github_stub.repositories = make_repositories(30)
+    github_stub.delay = 0.05
+    client = GitHubClient("token", api_url=github_stub.url)
+    repositories = [("owner", f"repo{i}") for i in range(30)]
+
+    languages = query_github_repositories_language(client, repositories, max_workers=3, batch_size=None)
+
+    assert len(languages) == 30
+    assert github_stub.max_in_flight == 3
+
+
+def test_forbidden_is_not_cached_as_not_found(github_stub, tmp_path):
+    github_stub.repositories = make_repositories(1)
+    github_stub.repositories["owner/missing"] = None
+    github_stub.script(
+        LANGUAGES_PATH.format("owner/repo0"), (403, {}, {"message": "Resource protected by organization SAML enforcement"})
+    )
+    client = GitHubClient("token", api_url=github_stub.url, max_retries=0)
+    cache = RepositoryLanguagesCache(tmp_path / "cache.sqlite", ttl=3600, negative_ttl=3600)
+
+    assert get_repository_languages(client, "owner", "repo0", cache) is None
+    assert cache.get("owner", "repo0") is None
+
+    assert get_repository_languages(client, "owner", "missing", cache) is None
+    assert cache.get("owner", "missing").status == STATUS_NOT_FOUND
+
+    # the forbidden repository is queried again
+    assert get_repository_languages(client, "owner", "repo0", cache) == [("Python", 1000), ("Shell", 10)]
+    cache.close()